@@ -24,8 +24,67 @@ from trees_world import *
 
 INDENT = '---->'
 
+# These are the defaults for the options of the same names a Tree takes (see Tree.__init__),
+# which change how it goes through its day.
+
+# Do the water and mineral uptake for all the root tips in one batch at the start of the day.
+# The soil ends up the same, but root internodes created during the day take nothing up until the next.
+BATCH_ROOT_UPTAKE = False
+
+# Work out the blocks of all the parts in one batch at the end of the day. Parts claim blocks in the
+# same order, but leaf clusters looking up for shade see the blocks other parts had the day before.
+BATCH_BLOCK_OCCUPATION = False
+
+# Place all the parts in one pass at the end of the day, a generation at a time, and then have them
+# claim their blocks. Internodes seeking better locations for their ends see the soil as it is at the end of the day.
+BATCH_FRAME_PROPAGATION = False
+
+# Keep the state of the parts in arrays with a row for each part (see PartStateArrays). Consumption, growth,
+# aging and the deaths that go with them happen for the whole tree after the day signal has gone around,
+# and the parts are placed at the end of the day, so trees grow a little differently.
+ARRAY_PART_STATE = False
+
+# Photosynthesize all the leaf clusters in one batch at the start of the day. Leaf clusters see the water
+# and minerals they had before their internodes passed any on today, and the shade of yesterday's blocks.
+BATCH_LEAF_UPTAKE = False
+
+# Every day, also add up the stresses of the leaf clusters the slow way and print a note if the running
+# totals (see Tree.calculateStresses) have drifted from them. This is only for checking the totals.
+CHECK_STRESS_TOTALS = False
+
+# Move biomass, water and minerals through all the internodes at once at the start of the day, in
+# transportRoundsPerDay rounds (see Tree.transportResources), so they can travel that many internodes in a day.
+# Things then move down the tree as fast as up, so under water or mineral stress much more biomass goes to the roots.
+SOLVE_RESOURCE_TRANSPORT = False
+TRANSPORT_ROUNDS_PER_DAY = 10
+
+# Go through the day a phase at a time (see Tree.nextDayByPhase): uptake for all the parts, then consumption,
+# and so on. Internodes hand things on before any of their dependents use them, so trees grow differently.
+PHASE_SYNCHRONOUS_DAY = False
+
+# With phaseSynchronousDay, have each part do all its phases before the next part starts instead. Trees then
+# grow as they do without it; this is only for checking the phase-at-a-time day against the usual one.
+PHASE_SYNCHRONOUS_DAY_IN_SIGNAL_ORDER = False
+
+def partsInSignalOrder(firstPart, nextPartsMethodName):
+	# Goes around the tree (or part of it) without recursion, so very large trees can't run out of stack:
+	# first the first part, then each of the parts its named method gives (in order), each with everything
+	# that comes after it, and so on. The method is asked for the next parts only after the caller 
+	# is done with a part, which is when the recursive methods used to ask for them.
+	stack = [firstPart]
+	while stack:
+		part = stack.pop()
+		yield part
+		nextParts = getattr(part, nextPartsMethodName)()
+		nextParts.reverse()
+		stack.extend(nextParts)
+
+# The things every part does each day, in the order it does them (see TreePart.nextDay_ThisPart).
+DAY_PHASES = ("nextDay_Uptake", "nextDay_Consumption", "nextDay_Distribution", "nextDay_Growth", 
+			"nextDay_BlockOccupation", "nextDay_Aging")
+
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
-class TreePart():
+class TreePart(object):
 # The TreePart is the superclass for all parts of the tree. Only a few methods are common to all tree parts.
 # For modeling growth, all parts have biomass, water and minerals, which get passed around the tree.
 # For occupying space, all parts have a 3D matrix which stores their location and orientation,
@@ -33,13 +92,34 @@ class TreePart():
 # The blocks are meant to be the interface with the block-identity system in general,
 # so that if you broke a block the tree could find out which of its parts that block belonged to
 # and do something to that part (kill it or reduce its biomass) in response.
+# A tree can have many thousands of parts, so every part class lists its fields in __slots__
+# (which keeps each part small) and the ones worth reporting in describeFields.
+# The fields a tree can keep in arrays instead (see PartStateArrays) are listed in stateFields.
+# They are not in the part classes' own slots but in those of a subclass (fieldsClass),
+# or in the row a row view (rowClass) reads and writes; TreePart.__new__ picks which.
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
+	__slots__ = ("tree", "parent", "matrix", "blocks", "previousBlocks", "blockGeometry", "spaceID")
+	stateFields = ("age", "alive", "biomass", "water", "minerals")
+	describeFields = ("age", "alive", "biomass", "water", "minerals", "matrix", "spaceID")
+	# the day phases each part class actually does something in, so a tree going through the day
+	# a phase at a time (see Tree.nextDayByPhase) doesn't have to ask the others
+	dayPhases = ("nextDay_BlockOccupation", "nextDay_Aging")
+
+	def __new__(cls, tree, *args, **keywordArgs):
+		# A tree that keeps the state of its parts in arrays (see ARRAY_PART_STATE) makes row views of its parts.
+		if tree.partState is not None:
+			return object.__new__(cls.rowClass)
+		return object.__new__(cls.fieldsClass)
+
 	def __init__(self, tree, parent, matrix, biomass=0, water=0, minerals=0):
 		self.tree = tree
 		self.parent = parent
+		if tree.partState is not None:
+			self.row = tree.partState.addRow(self, parent)
 		self.age = 0
 		self.alive = True
+		tree.liveParts[self.typeCode].add(self)
 		
 		self.biomass = biomass
 		self.water = water
@@ -47,14 +127,18 @@ class TreePart():
 		
 		self.matrix = matrix # should be new copy, not pointer to one already in use
 		self.blocks = []
+		self.previousBlocks = []
+		self.blockGeometry = None # everything the blocks were calculated from, last time
+		self.spaceID = tree.world.registerTreePart(self) # what the space grid stores for blocks this part occupies
 		
 	def nextDay(self):
 		# The next-day "signal" moves up the tree, with each part performing its daily calculations.
 		# Internodes, being the "pipes" of the system, handle making sure every part finds out
-		# about the signal.
-		# To start out, each part relinquishes all blocks in the world-space it had been occupying,
-		# on its way to claiming new blocks. In many cases parts will not move, but sometimes they will.
-		self.releaseAllUsedBlocks()
+		# about the signal (see Internode.signalRecipients).
+		for part in partsInSignalOrder(self, "signalRecipients"):
+			part.nextDay_ThisPart()
+		
+	def nextDay_ThisPart(self):
 		# Uptake is of photosynthate (for leaf clusters) or water and minerals (for root internodes).
 		self.nextDay_Uptake()
 		# All tree parts use up a little biomass each day in maintenance respiration.
@@ -64,10 +148,11 @@ class TreePart():
 		self.nextDay_Distribution()
 		# In the growth method each part calculates its updated size.
 		self.nextDay_Growth()
-		# In the occupation method each part reclaims blocks in the space it should be occupying.
+		# In the occupation method each part reclaims blocks in the space it should be occupying,
+		# and lets go of any blocks it had been occupying but no longer needs.
+		# In many cases parts will not move, but sometimes they will.
 		self.nextDay_BlockOccupation()
-		# Finally the internodes tell their children about the next day signal.
-		self.nextDay_SignalPropagation()
+		# Finally the internodes tell their children about the next day signal (see nextDay).
 		self.age += 1
 		
 	def nextDay_Uptake(self):
@@ -80,10 +165,44 @@ class TreePart():
 	def nextDay_Distribution(self):
 		pass
 	
+	def biomassINeed(self):
+		# How much of each thing a part would take if it were offered, which is what its accept methods
+		# (and Tree.transportResources) go by. Parts that don't take something need none of it.
+		return 0
+	
+	def waterINeed(self):
+		return 0
+	
+	def mineralsINeed(self):
+		return 0
+	
+	def nextDay_Aging(self):
+		self.age += 1
+	
 	def nextDay_BlockOccupation(self):
-		pass
+		# Each part first works out where it is now (from its parent), then claims the blocks it should occupy there.
+		# When the tree is propagating frames in a batch (see BATCH_FRAME_PROPAGATION), the tree works out
+		# where all the parts are at the end of the day, and then has them claim their blocks.
+		if self.tree.partsToPosition is not None:
+			self.tree.partsToPosition.append(self)
+		else:
+			self.calculatePosition()
+			self.claimBlocks()
+	
+	def signalRecipients(self):
+		return []
 	
-	def nextDay_SignalPropagation(self):
+	def attachment(self):
+		# How the part hangs off the end of its parent internode (see Internode.matrixForAttachment),
+		# or None if it doesn't move.
+		return None
+	
+	def calculatePosition(self):
+		attachment = self.attachment()
+		if attachment is not None:
+			self.matrix = self.parent.matrixForAttachment(attachment)
+	
+	def claimBlocks(self):
 		pass
 		
 	def die(self):
@@ -92,22 +211,92 @@ class TreePart():
 		# materials to be collected. I have this as a simple flag, but it would be
 		# better to have a "dying period" over which a part gradually switches over
 		# rather than an instantaneous switch.
+		if self.alive:
+			self.tree.partDied(self)
 		self.alive = False
 	
 	def releaseAllUsedBlocks(self):
-		# When a part recalculates its position it releases the blocks it had been occupying
+		# When a part goes away it releases the blocks it had been occupying
 		# so other parts can take them up. 
 		for location in self.blocks:
 			roundedLocation = location.rounded()
-			releaseLocation(roundedLocation, self)
+			self.tree.world.releaseLocation(roundedLocation, self)
+		self.blocks = []
+		self.blockGeometry = None
+		
+	def startClaimingBlocks(self, geometry):
+		# Each day a part claims the blocks it should be occupying. Working out those blocks is expensive,
+		# so the part first compares everything its blocks depend on (its geometry) with what they were
+		# last time. If nothing has changed it just reclaims the same blocks (which puts it back on top
+		# of any block another part has pushed it aside from), and this returns False.
+		# Otherwise this returns True, and the part claims its new blocks and then calls finishClaimingBlocks,
+		# which lets go of the old blocks it no longer uses. Either way the space ends up exactly as if the part
+		# had released all its blocks and claimed them all over again.
+		# When the tree is occupying blocks in a batch, all of this happens at the end of the day instead.
+		batch = self.tree.occupationBatch
+		if self.blockGeometry is not None and geometry == self.blockGeometry:
+			if batch is not None:
+				batch.addPart(self, False)
+			else:
+				self.reclaimBlocks()
+			return False
+		self.blockGeometry = geometry
+		self.previousBlocks = self.blocks
 		self.blocks = []
+		if batch is not None:
+			batch.addPart(self, True)
+		return True
+	
+	def reclaimBlocks(self):
+		world = self.tree.world
+		for location in self.blocks:
+			world.claimLocation(location, self)
+	
+	def finishClaimingBlocks(self):
+		if self.tree.occupationBatch is None:
+			self.releaseBlocksNoLongerUsed()
+			
+	def releaseBlocksNoLongerUsed(self):
+		if self.previousBlocks:
+			world = self.tree.world
+			blocksStillUsed = set([(location.x, location.y, location.z) for location in self.blocks])
+			for location in self.previousBlocks:
+				key = (location.x, location.y, location.z)
+				if not key in blocksStillUsed:
+					world.releaseLocation(location, self)
+					blocksStillUsed.add(key) # only release once
+			self.previousBlocks = []
 		
 	def claimStartBlock(self):
+		batch = self.tree.occupationBatch
+		if batch is not None:
+			batch.addLocations([self.matrix.location], None)
+			return
 		roundedLocation = self.matrix.location.rounded()
-		self.blocks = [roundedLocation]
-		claimLocation(roundedLocation, self)
+		self.blocks.append(roundedLocation)
+		self.tree.world.claimLocation(roundedLocation, self)
+		
+	def claimLine(self, firstLocation, secondLocation, numPoints, lineMethod, aboveGround=True):
+		batch = self.tree.occupationBatch
+		if batch is not None and lineMethod == "solid":
+			batch.addLine(firstLocation, secondLocation, aboveGround)
+		else:
+			self.claimSeriesOfBlocks(locationsBetweenTwoPoints(firstLocation, secondLocation, numPoints, lineMethod), aboveGround)
+			
+	def claimVoxels(self, voxels, aboveGround=True):
+		# voxels is an array of (x, y, z) integer rows
+		batch = self.tree.occupationBatch
+		if batch is not None:
+			batch.addVoxels(voxels, aboveGround)
+		else:
+			self.claimSeriesOfBlocks([Point3D(x, y, z) for x, y, z in voxels.tolist()], aboveGround)
 		
 	def claimSeriesOfBlocks(self, locations, aboveGround=True):
+		batch = self.tree.occupationBatch
+		if batch is not None:
+			batch.addLocations(locations, aboveGround)
+			return
+		world = self.tree.world
 		for location in locations:
 			roundedLocation = location.rounded()
 			# Normally you should bound each block location to make sure it doesn't extend beyond the space "box"
@@ -116,17 +305,15 @@ class TreePart():
 			# will create a gap between stem and root which looks strange.
 			# In an infinite-xy world this bounding would go away, but at the top/bottom of the world it would still apply.
 			if location != self.tree.trunkMatrix.location and location != self.tree.rootMatrix.location:
-				roundedLocation = boundLocation(roundedLocation, aboveGround)
+				roundedLocation = world.boundLocation(roundedLocation, aboveGround)
 			self.blocks.append(roundedLocation)
-			claimLocation(roundedLocation, self)
+			world.claimLocation(roundedLocation, self)
 				
 	def describe(self, outputFile, indentCounter):
-		outputFile.write(INDENT * indentCounter + ' %s: \n' % self.__class__.__name__)
-		fields = self.__dict__
-		for key in fields:
-			valueAsString = "%s" % fields[key]
-			if not valueAsString.find("instance") >= 0:
-				outputFile.write(INDENT * (indentCounter+1) + key + ": " + valueAsString + "\n")
+		outputFile.write(INDENT * indentCounter + ' %s: \n' % self.typeName)
+		for key in self.describeFields:
+			valueAsString = str(getattr(self, key, None))
+			outputFile.write(INDENT * (indentCounter+1) + key + ": " + valueAsString + "\n")
 		outputFile.write("\n")
 
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
@@ -148,6 +335,13 @@ class Meristem(TreePart):
 # different off the main trunk or a subsidiary branch.
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
+	__slots__ = ("apical", "numberOnParentInternode", "active", "reproductive")
+	stateFields = TreePart.stateFields + ("root", "branchNestingLevel")
+	describeFields = TreePart.describeFields + ("apical", "root", "numberOnParentInternode", "branchNestingLevel", "active", "reproductive")
+	typeName = "Meristem"
+	typeCode = 0 # what kind of part a row of PartStateArrays is
+	dayPhases = ("nextDay_Uptake", "nextDay_Growth", "nextDay_BlockOccupation", "nextDay_Aging")
+
 	def __init__(self, tree, parent, root, branchNestingLevel, numberOnParentInternode, matrix, apical=False, biomass=0, water=0, minerals=0):
 		TreePart.__init__(self, tree, parent, matrix, biomass=START_MERISTEM_BIOMASS[root], water=0, minerals=0)
 		self.apical = apical
@@ -213,14 +407,18 @@ class Meristem(TreePart):
 						self.buildInternode()
 						self.parent.removeMeristemThatMadeInternode(self)
 						
-	def nextDay_BlockOccupation(self):
+	def attachment(self):
 		if self.apical:
-			self.matrix = self.parent.matrixForApicalMeristemOrChildInternode(0)
+			return self.parent.attachmentForApicalMeristemOrChildInternode(0)
 		else:
-			self.matrix = self.parent.matrixForAxillaryMeristemOrBranchInternode(self.numberOnParentInternode, 0)
+			return self.parent.attachmentForAxillaryMeristemOrBranchInternode(self.numberOnParentInternode, 0)
+		
+	def claimBlocks(self):
 		if DRAW_MERISTEMS:
 			# meristems are always only one block
-			self.claimStartBlock()
+			if self.startClaimingBlocks(self.matrix.location.rounded()):
+				self.claimStartBlock()
+				self.finishClaimingBlocks()
 		
 	# -------------------------------------------------------------------------------------------
 	# methods used by next day methods
@@ -250,25 +448,19 @@ class Meristem(TreePart):
 						self.reproduce()
 		
 	def distanceOfParentFromBranchApex(self):
-		# this running up the branch is inefficient and may be able to be calculated less often and stored
-		distance = 0
-		internode = self.parent
-		while internode:
-			distance += 1
-			internode = internode.child
-		if internode and not internode.apicalMeristem: # apical meristem is missing, perhaps removed
-			if self.branchNestingLevel == 0:
-				distance = APICAL_DOMINANCE_OFF_TRUNK[self.root] + 1
-			else:
-				distance = APICAL_DOMINANCE_NOT_OFF_TRUNK[self.root] + 1 
-		return distance
+		# how many internodes there are from the parent to the end of its stem, counting the parent
+		# (internodes keep this up to date as their stems grow; see Internode.addChildInternode)
+		if self.parent:
+			return self.parent.distanceToApex
+		return 0
 		
-	def acceptBiomass(self, biomassOffered):
+	def biomassINeed(self):
 		if self.alive and self.active:
-			biomassINeed = max(0, (BIOMASS_TO_MAKE_ONE_PHYTOMER[self.root] + BIOMASS_USED_BY_MERISTEM_PER_DAY[self.root]) - self.biomass)
-		else:
-			biomassINeed = 0
-		biomassIWillAccept = min(biomassOffered, biomassINeed)
+			return max(0, (BIOMASS_TO_MAKE_ONE_PHYTOMER[self.root] + BIOMASS_USED_BY_MERISTEM_PER_DAY[self.root]) - self.biomass)
+		return 0
+	
+	def acceptBiomass(self, biomassOffered):
+		biomassIWillAccept = min(biomassOffered, self.biomassINeed())
 		self.biomass += biomassIWillAccept
 		return biomassIWillAccept
 	
@@ -282,6 +474,52 @@ class Meristem(TreePart):
 			if randomNumber < probabilityIWillTurnReproductive:
 				self.reproductive = True
 			
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+# Distribution plans.
+# Each name in a distribution order (see BIOMASS_DISTRIBUTION_ORDER) stands for some of the parts
+# around an internode. Since the orders don't change once the species is read in, they are turned
+# into plans once: tuples of functions that give an internode those parts (with None or False for
+# parts that aren't there), leaving out the names that never give anything for stems or for roots.
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+# name: (parts, used by stems, used by roots)
+DISTRIBUTEES_FOR_NAME = {
+	"leaves": (lambda internode: internode.leafClusters, True, False),
+	"flowers": (lambda internode: internode.flowerClusters, True, False),
+	"fruits": (lambda internode: internode.fruitClusters, True, False),
+	"apical meristems": (lambda internode: (internode.apicalMeristem,), True, True),
+	"axillary meristems": (lambda internode: internode.axillaryMeristems, True, True),
+	"child": (lambda internode: (internode.child,), True, True),
+	"branches": (lambda internode: internode.branches, True, True),
+	"parent": (lambda internode: (internode.parent,), True, True),
+	"root": (lambda internode: (internode.firstOnTree and internode.tree.firstRootInternode,), True, False),
+	"above-ground tree": (lambda internode: (internode.firstOnTree and internode.tree.firstInternode,), False, True),
+	}
+
+def distributionPlan(order, root):
+	plan = []
+	for name in order:
+		if name in DISTRIBUTEES_FOR_NAME:
+			distributees, usedByStems, usedByRoots = DISTRIBUTEES_FOR_NAME[name]
+			if (root and usedByRoots) or (not root and usedByStems):
+				plan.append(distributees)
+	return tuple(plan)
+
+def makeDistributionPlans():
+	# Biomass plans (with the spread to go with them) are looked up by the tree's prevailing stress condition
+	# and whether the internode is a root; water and mineral plans just by whether it is a root.
+	biomassPlans = {}
+	for stressCondition, orderName in [("no stress", "no stress"), ("low sun and shade", "low sun and shade"), 
+			("water", "water or mineral stress"), ("minerals", "water or mineral stress"), ("reproduction", "reproduction")]:
+		for root in [False, True]:
+			biomassPlans[stressCondition, root] = (distributionPlan(BIOMASS_DISTRIBUTION_ORDER[orderName][root], root), 
+				BIOMASS_DISTRIBUTION_SPREAD[orderName][root])
+	waterPlans = [distributionPlan(WATER_DISTRIBUTION_ORDER[root], root) for root in [False, True]]
+	mineralsPlans = [distributionPlan(MINERALS_DISTRIBUTION_ORDER[root], root) for root in [False, True]]
+	return biomassPlans, waterPlans, mineralsPlans
+
+BIOMASS_DISTRIBUTION_PLANS, WATER_DISTRIBUTION_PLANS, MINERALS_DISTRIBUTION_PLANS = makeDistributionPlans()
+
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 class Internode(TreePart):
 	
@@ -301,6 +539,18 @@ class Internode(TreePart):
 #	0 to n fruit clusters - which were flower clusters but moved on past that stage
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
+	__slots__ = ("child", "branches", "flowerClusters", "fruitClusters", "leafClusters",
+				"apicalMeristem", "axillaryMeristems", "iAmABranchOffMyParent", "numberOnParentInternode", 
+				"randomSway", "endLocation", "distanceToApex")
+	stateFields = TreePart.stateFields + ("root", "firstOnTree", "branchNestingLevel", "woody", "length", "width")
+	# the related parts describe themselves under this one
+	describeFields = TreePart.describeFields + ("root", "firstOnTree", "branchNestingLevel", 
+				"iAmABranchOffMyParent", "numberOnParentInternode", "randomSway", "woody",
+				"length", "width", "endLocation")
+	typeName = "Internode"
+	typeCode = 1
+	dayPhases = DAY_PHASES
+
 	def __init__(self, tree, parent, root, branchNestingLevel, matrix, numberOnParentInternode, firstOnTree, iAmABranchOffMyParent):
 		TreePart.__init__(self, tree, parent, matrix, biomass=START_INTERNODE_BIOMASS[root], water=0, minerals=0)
 		self.child = None
@@ -314,6 +564,7 @@ class Internode(TreePart):
 		
 		self.iAmABranchOffMyParent = iAmABranchOffMyParent
 		self.numberOnParentInternode = numberOnParentInternode
+		self.distanceToApex = 1 # how many internodes there are from here to the end of the stem, counting this one
 		
 		self.tree.numInternodesCreated += 1
 		if RANDOM_INTERNODE_SWAY[self.root] > 0:
@@ -353,45 +604,67 @@ class Internode(TreePart):
 			newLeafCluster = LeafCluster(self.tree, self, leafClusterNumber, newLeafMatrix)
 			self.leafClusters.append(newLeafCluster)
 			
-	def matrixForApicalMeristemOrChildInternode(self, randomSway):
-		# new matrices have to be created every day, because the internode itself may have changed
-		# in length as it grew (and in end location if it is woody and is seeking sun/water/minerals)
-		# this is horribly inefficient and could be improved in optimization
-		# but on the other hand, matrices are not huge things, and it's not the biggest bottleneck
+	# New matrices have to be created every day, because the internode itself may have changed
+	# in length as it grew (and in end location if it is woody and is seeking sun/water/minerals).
+	# Every part attached to an internode hangs off its end in the same way: move some distance along the
+	# internode, turn around the x axis, turn around the y axis, then move some distance in the new direction.
+	# An "attachment" is those four numbers (move before, x rotation, y rotation, move after), which is 
+	# all the tree needs to work out where all of its parts are at once (see Tree.propagateFrames).
+	
+	def matrixForAttachment(self, attachment):
+		moveBefore, xRotation, yRotation, moveAfter = attachment
 		newMatrix = self.matrix.makeCopy()
 		newMatrix.setLocation(self.endLocation.x, self.endLocation.y, self.endLocation.z)
-		newMatrix.move(1.0)
-		newMatrix.rotateX(90)
-		newMatrix.rotateY(randomSway)
+		newMatrix.move(moveBefore)
+		if xRotation:
+			newMatrix.rotateX(xRotation)
+		newMatrix.rotateY(yRotation)
+		if moveAfter:
+			newMatrix.move(moveAfter)
 		return newMatrix
 	
+	def matrixForApicalMeristemOrChildInternode(self, randomSway):
+		return self.matrixForAttachment(self.attachmentForApicalMeristemOrChildInternode(randomSway))
+	
 	def matrixForAxillaryMeristemOrBranchInternode(self, numberOnParentInternode, randomSway):
+		return self.matrixForAttachment(self.attachmentForAxillaryMeristemOrBranchInternode(numberOnParentInternode, randomSway))
+	
+	def matrixForLeafCluster(self, numberOnParentInternode, randomSway):
+		return self.matrixForAttachment(self.attachmentForLeafCluster(numberOnParentInternode, randomSway))
+	
+	def matrixForFlowerCluster(self, numberOnParentInternode, randomSway):
+		return self.matrixForAttachment(self.attachmentForFlowerCluster(numberOnParentInternode, randomSway))
+	
+	def matrixForFruitCluster(self, numberOnParentInternode, randomSway):
+		return self.matrixForAttachment(self.attachmentForFruitCluster(numberOnParentInternode, randomSway))
+	
+	def attachmentForApicalMeristemOrChildInternode(self, randomSway):
+		return (1.0, 90, randomSway, 0.0)
+	
+	def attachmentForAxillaryMeristemOrBranchInternode(self, numberOnParentInternode, randomSway):
 		if self.branchNestingLevel == 0:
 			sideAngle = ANGLE_BETWEEN_STEM_AND_BRANCH_OFF_TRUNK[self.root]
 		else:
 			sideAngle = ANGLE_BETWEEN_STEM_AND_BRANCH_NOT_OFF_TRUNK[self.root]
 		sideAngle += randomSway
-		return self.matrixForPartAttachedToInternodeEnd(numberOnParentInternode, -1.0, sideAngle)
+		return self.attachmentForPartAttachedToInternodeEnd(numberOnParentInternode, -1.0, sideAngle)
 	
-	def matrixForLeafCluster(self, numberOnParentInternode, randomSway):
+	def attachmentForLeafCluster(self, numberOnParentInternode, randomSway):
 		sideAngle = LEAF_CLUSTER_ANGLE_WITH_STEM
 		sideAngle += randomSway
-		return self.matrixForPartAttachedToInternodeEnd(numberOnParentInternode, -2.0, sideAngle)
+		return self.attachmentForPartAttachedToInternodeEnd(numberOnParentInternode, -2.0, sideAngle)
 	
-	def matrixForFlowerCluster(self, numberOnParentInternode, randomSway):
+	def attachmentForFlowerCluster(self, numberOnParentInternode, randomSway):
 		sideAngle = FLOWER_CLUSTER_ANGLE_WITH_STEM
 		sideAngle += randomSway
-		return self.matrixForPartAttachedToInternodeEnd(numberOnParentInternode, -2.0, sideAngle)
+		return self.attachmentForPartAttachedToInternodeEnd(numberOnParentInternode, -2.0, sideAngle)
 	
-	def matrixForFruitCluster(self, numberOnParentInternode, randomSway):
+	def attachmentForFruitCluster(self, numberOnParentInternode, randomSway):
 		sideAngle = FRUIT_CLUSTER_ANGLE_WITH_STEM
 		sideAngle += randomSway
-		return self.matrixForPartAttachedToInternodeEnd(numberOnParentInternode, -2.0, sideAngle)
+		return self.attachmentForPartAttachedToInternodeEnd(numberOnParentInternode, -2.0, sideAngle)
 	
-	def matrixForPartAttachedToInternodeEnd(self, numberOnParentInternode, pullBack, sideAngle):
-		newMatrix = self.matrix.makeCopy()
-		newMatrix.setLocation(self.endLocation.x, self.endLocation.y, self.endLocation.z)
-		newMatrix.move(pullBack)
+	def attachmentForPartAttachedToInternodeEnd(self, numberOnParentInternode, pullBack, sideAngle):
 		if AXILLARY_MERISTEMS_PER_INTERNODE[self.root] == 1:
 			xRotation = 0
 		elif AXILLARY_MERISTEMS_PER_INTERNODE[self.root] == 2:
@@ -404,17 +677,23 @@ class Internode(TreePart):
 				xRotation = 0
 			else:
 				xRotation = 90 * numberOnParentInternode
-		if xRotation > 0:
-			newMatrix.rotateX(xRotation)
-		newMatrix.rotateY(sideAngle)
 		if self.width == 1:
-			newMatrix.move(1.0)
+			moveOut = 1.0
 		else:
-			newMatrix.move(self.width / 2)
-		return newMatrix
+			moveOut = self.width / 2
+		return (pullBack, xRotation, sideAngle, moveOut)
 		
 	def addChildInternode(self, internode):
 		self.child = internode
+		# the stem is one internode longer for everything on it, back to where it branched off
+		distance = internode.distanceToApex
+		stemInternode = self
+		while stemInternode:
+			distance += 1
+			stemInternode.distanceToApex = distance
+			if stemInternode.iAmABranchOffMyParent:
+				break
+			stemInternode = stemInternode.parent
 		
 	def addBranchInternode(self, internode):
 		self.branches.append(internode)
@@ -427,6 +706,7 @@ class Internode(TreePart):
 				
 	def removeMeristemThatMadeInternode(self, meristem):
 		# after a meristem makes a new internode, it goes away, because it turns INTO the internode
+		self.tree.partWentAway(meristem)
 		if meristem.apical:
 			self.apicalMeristem = None
 		else:
@@ -448,32 +728,10 @@ class Internode(TreePart):
 		# and it complicates the model for no useful reason, except possibly that
 		# you could remove all leaves from a tree and it might not quite die.
 		# But that doesn't seem all that compelling. Still, it would be easy to put back.
-		if self.root and self.alive:
-			x = int(round(self.endLocation.x))
-			y = int(round(self.endLocation.y))
-			z = int(round(self.endLocation.z))
-			# Note that the locations in the water, minerals and sun arrays are not rounded Point3Ds but tuples of ints
-			# (for no good reason)
-			availableWater, locationsConsidered = waterOrMineralsInRegion("water", self.endLocation, ROOT_WATER_EXTRACTION_RADIUS)
-			if availableWater > 0:
-				for locationTuple in locationsConsidered:
-					if water.has_key(locationTuple):
-						waterAtLocation = water[locationTuple]
-					else:
-						waterAtLocation = 0
-					if waterAtLocation > 0:
-						waterExtractedFromLocation = ROOT_WATER_EXTRACTION_EFFICIENCY * waterAtLocation
-						self.water += waterExtractedFromLocation
-						water[locationTuple] -= waterExtractedFromLocation
-			availableMinerals, locationsConsidered = waterOrMineralsInRegion("minerals", self.endLocation, ROOT_MINERAL_EXTRACTION_RADIUS)
-			if availableMinerals > 0:
-				for locationTuple in locationsConsidered:
-					if minerals.has_key(locationTuple):
-						mineralsAtLocation = minerals[locationTuple]
-						if mineralsAtLocation > 0:
-							mineralsExtractedFromLocation = ROOT_MINERAL_EXTRACTION_EFFICIENCY * mineralsAtLocation
-							self.minerals += mineralsExtractedFromLocation
-							minerals[locationTuple] -= mineralsExtractedFromLocation
+		if self.root and self.alive and not self.tree.batchRootUptake:
+			world = self.tree.world
+			self.water += float(world.extractWaterOrMinerals("water", [self.endLocation], ROOT_WATER_EXTRACTION_RADIUS, ROOT_WATER_EXTRACTION_EFFICIENCY)[0])
+			self.minerals += float(world.extractWaterOrMinerals("minerals", [self.endLocation], ROOT_MINERAL_EXTRACTION_RADIUS, ROOT_MINERAL_EXTRACTION_EFFICIENCY)[0])
 	
 	def nextDay_Consumption(self):
 		if self.alive:
@@ -487,49 +745,42 @@ class Internode(TreePart):
 				self.biomass -= biomassINeedToUseToday
 	
 	def nextDay_Distribution(self):
-		if self.tree.prevailingStressCondition == "no stress":
-			biomassDistributionOrder = BIOMASS_DISTRIBUTION_ORDER["no stress"][self.root]
-			biomassSpread = BIOMASS_DISTRIBUTION_SPREAD["no stress"][self.root]
-		elif self.tree.prevailingStressCondition == "low sun and shade":
-			biomassDistributionOrder = BIOMASS_DISTRIBUTION_ORDER["low sun and shade"][self.root]
-			biomassSpread = BIOMASS_DISTRIBUTION_SPREAD["low sun and shade"][self.root]
-		elif self.tree.prevailingStressCondition in ["water", "minerals"]:
-			biomassDistributionOrder = BIOMASS_DISTRIBUTION_ORDER["water or mineral stress"][self.root]
-			biomassSpread = BIOMASS_DISTRIBUTION_SPREAD["water or mineral stress"][self.root]
-		elif self.tree.prevailingStressCondition == "reproduction":
-			biomassDistributionOrder = BIOMASS_DISTRIBUTION_ORDER["reproduction"][self.root]
-			biomassSpread = BIOMASS_DISTRIBUTION_SPREAD["reproduction"][self.root]
-		parts = self.gatherDistributees(biomassDistributionOrder)
-		for part in parts:
-			if part:
-				extra = max(0, self.biomass - OPTIMAL_INTERNODE_BIOMASS[self.root] - BIOMASS_USED_BY_INTERNODE_PER_DAY[self.root])
-				if extra > 0:
-					toBeGivenAway = extra * biomassSpread
-					taken = part.acceptBiomass(toBeGivenAway)
-					self.biomass -= taken
+		# the plans say who lines up for what, in order (see makeDistributionPlans)
+		if self.tree.solveResourceTransport:
+			return # the tree already moved everything this morning (see Tree.transportResources)
+		root = self.root
+		biomassDistributionPlan, biomassSpread = BIOMASS_DISTRIBUTION_PLANS[self.tree.prevailingStressCondition, root]
+		for distributees in biomassDistributionPlan:
+			for part in distributees(self):
+				if part:
+					extra = max(0, self.biomass - OPTIMAL_INTERNODE_BIOMASS[root] - BIOMASS_USED_BY_INTERNODE_PER_DAY[root])
+					if extra > 0:
+						toBeGivenAway = extra * biomassSpread
+						taken = part.acceptBiomass(toBeGivenAway)
+						self.biomass -= taken
 		# If you wanted to make the water and mineral distribution orders dependent on stress conditions,
 		# it would be fairly easy to create a similar set of arrays to those of biomass.
 		# I felt it would be complication without useful purpose, which I tried to trim.
-		parts = self.gatherDistributees(WATER_DISTRIBUTION_ORDER[self.root])
-		for part in parts:
-			if part:
-				extra = self.water
-				if extra > 0:
-					toBeGivenAway = extra * WATER_DISTRIBUTION_SPREAD_PERCENT[self.root] 
-					taken = part.acceptWater(toBeGivenAway)
-					self.water -= taken
-		parts = self.gatherDistributees(MINERALS_DISTRIBUTION_ORDER[self.root])
-		for part in parts:
-			if part:
-				extra = self.minerals
-				if extra > 0:
-					toBeGivenAway = extra * MINERALS_DISTRIBUTION_SPREAD_PERCENT[self.root] 
-					taken = part.acceptMinerals(toBeGivenAway)
-					self.minerals -= taken
+		for distributees in WATER_DISTRIBUTION_PLANS[root]:
+			for part in distributees(self):
+				if part:
+					extra = self.water
+					if extra > 0:
+						toBeGivenAway = extra * WATER_DISTRIBUTION_SPREAD_PERCENT[root] 
+						taken = part.acceptWater(toBeGivenAway)
+						self.water -= taken
+		for distributees in MINERALS_DISTRIBUTION_PLANS[root]:
+			for part in distributees(self):
+				if part:
+					extra = self.minerals
+					if extra > 0:
+						toBeGivenAway = extra * MINERALS_DISTRIBUTION_SPREAD_PERCENT[root] 
+						taken = part.acceptMinerals(toBeGivenAway)
+						self.minerals -= taken
 				
 	def nextDay_Growth(self):
 		if self.alive: # if not, stay the same size as you were when you died
-			self.woody = self.age > INTERNODES_TURN_WOODY_AFTER_THIS_MANY_DAYS
+			self.woody = self.age > INTERNODES_TURN_WOODY_AFTER_THIS_MANY_DAYS[self.root]
 			proportion = self.biomass / OPTIMAL_INTERNODE_BIOMASS[self.root]
 			if self.firstOnTree:
 				lengthICanGrow = FIRST_INTERNODE_GROWTH_IN_LENGTH_AT_FULL_SIZE[self.root] - FIRST_INTERNODE_LENGTH_AT_CREATION[self.root]
@@ -547,50 +798,53 @@ class Internode(TreePart):
 			self.width = INTERNODE_WIDTH_AT_CREATION[self.root] + proportion * widthICanGrow
 			self.width = max(INTERNODE_WIDTH_AT_CREATION[self.root], min(INTERNODE_GROWTH_IN_WIDTH_AT_FULL_SIZE[self.root], self.width))
 
-	def nextDay_BlockOccupation(self):
-		aboveGround = not self.root
+	def attachment(self):
 		# It is inefficient to get the matrix from the parent every day, especially when only the location has changed,
 		# not the orientation. If the matrix were separated into two parts (location, orientation) this could 
 		# be simplified a bit. Still, this is not the bottleneck.
 		if self.iAmABranchOffMyParent:
-			self.matrix = self.parent.matrixForAxillaryMeristemOrBranchInternode(self.numberOnParentInternode, self.randomSway)
-		else:
-			if self.parent:
-				self.matrix = self.parent.matrixForApicalMeristemOrChildInternode(self.randomSway)
+			return self.parent.attachmentForAxillaryMeristemOrBranchInternode(self.numberOnParentInternode, self.randomSway)
+		elif self.parent:
+			return self.parent.attachmentForApicalMeristemOrChildInternode(self.randomSway)
+		return None
+		
+	def calculatePosition(self):
+		TreePart.calculatePosition(self)
 		self.endLocation = self.matrix.calculateMove(self.length)
-		self.endLocation = boundLocation(self.endLocation, aboveGround)
+		self.endLocation = self.tree.world.boundLocation(self.endLocation, not self.root)
+		self.seekBetterEndLocation()
+		
+	def seekBetterEndLocation(self):
 		if self.alive and not self.woody and NON_WOODY_INTERNODES_SEEK_RESOURCES_IN_RADIUS[self.root] > 0:
-			self.endLocation = seekBetterLocation(self.endLocation, self.root, NON_WOODY_INTERNODES_SEEK_RESOURCES_IN_RADIUS[self.root])
+			self.endLocation = self.tree.world.seekBetterLocation(self.endLocation, self.root, NON_WOODY_INTERNODES_SEEK_RESOURCES_IN_RADIUS[self.root])
+		
+	def claimBlocks(self):
+		aboveGround = not self.root
 		if (self.root and DRAW_ROOTS) or (not self.root and DRAW_STEMS):
-			self.claimStartBlock()
-			pointsBetween = self.length * INTERNODE_LINE_DRAWING_DETAIL_MULTIPLIER
-			locationsBetween = locationsBetweenTwoPoints(self.matrix.location, self.endLocation, pointsBetween, INTERNODE_LINE_DRAWING_METHOD)
-			self.claimSeriesOfBlocks(locationsBetween, aboveGround)
-			if self.width > 1:
-				# THIS is the bottleneck. When stems are wide, working out the circles perpendicular to the stem vector
-				# seems to take a very long time. A better way to do that would speed things up a lot.
-				for location in locationsBetween:
-					turns = 4 + self.width//2
-					diameterPattern = str(int(round(self.width/2)))
-					circleLocations = locationsForShapeAroundSpine(locationsBetween, diameterPattern, turns, 1.0, INTERNODES_ARE_HOLLOW[self.root], self.matrix)
-					self.claimSeriesOfBlocks(circleLocations, aboveGround)
+			geometry = (self.matrix.asTuple(), self.endLocation, self.length, self.width)
+			if self.startClaimingBlocks(geometry):
+				self.claimStartBlock()
+				pointsBetween = self.length * INTERNODE_LINE_DRAWING_DETAIL_MULTIPLIER
+				self.claimLine(self.matrix.location, self.endLocation, pointsBetween, INTERNODE_LINE_DRAWING_METHOD, aboveGround)
+				if self.width > 1:
+					radius = int(round(self.width/2))
+					self.claimVoxels(voxelsForCylinder(self.matrix.location, self.endLocation, radius, INTERNODES_ARE_HOLLOW[self.root]), aboveGround)
+				self.finishClaimingBlocks()
 								
-	def nextDay_SignalPropagation(self):
+	def signalRecipients(self):
 		# This pattern never varies and is not parameterized. 
 		# Of course everything dependent on the internode gets the signal first 
 		# (leaves, flowers, fruits, meristems). The only thing that could be different
 		# is whether the child (on the same stem) or branches (starting new stems)
 		# get the signal first. Running out to the end of the stem before
 		# handling branches just seems to work better in terms of growth.
-		# Note that this method and all the other signal methods are recursive.
-		# When a plant is huge you could theoretically exhaust stack sizes.
-		# However, if you have the "number of internodes allowed" parameter set
-		# to a reasonable size (100 or so) this should not be a problem in practice. 
-		# It could be a problem if people wanted to create really gigantic (world-sized)
-		# trees. In that case you would have to resort to what we used back in the day,
-		# a "traverser" which ran around the plant talking to parts and tying them
-		# all together without recursion. It's much nicer to use the recursion
-		# if you can, however.
+		# The signal methods used to be recursive, which could exhaust stack sizes on really
+		# gigantic (world-sized) trees. Now they use what we used back in the day, a "traverser"
+		# (partsInSignalOrder) which runs around the plant talking to parts without recursion.
+		return self.dependents() + self.nextInternodes()
+	
+	def dependents(self):
+		# everything that hangs off this internode except other internodes
 		sendSignalTo = []
 		if not self.root:
 			sendSignalTo.extend(self.leafClusters)
@@ -598,20 +852,31 @@ class Internode(TreePart):
 			sendSignalTo.extend(self.fruitClusters)
 		sendSignalTo.extend([self.apicalMeristem])
 		sendSignalTo.extend(self.axillaryMeristems)
+		return [sendTo for sendTo in sendSignalTo if sendTo]
+	
+	def nextInternodes(self):
+		sendSignalTo = []
 		sendSignalTo.extend([self.child])
 		sendSignalTo.extend(self.branches)
-		for sendTo in sendSignalTo:
-			if sendTo:
-				sendTo.nextDay()
+		return [sendTo for sendTo in sendSignalTo if sendTo]
 		
 	# -------------------------------------------------------------------------------------------
 	# methods used by next day methods
 	# the internode has several methods that propagate signals to other parts
 	# -------------------------------------------------------------------------------------------
 		
-	def acceptBiomass(self, biomassOffered):
+	def biomassINeed(self):
 		# The internode, because it is a piping system, takes biomass it doesn't need so it can pass it on.
 		# So this is the one part that doesn't limit the amount of biomass (or anything else) it accepts.
+		return np.inf
+	
+	def waterINeed(self):
+		return np.inf
+	
+	def mineralsINeed(self):
+		return np.inf
+	
+	def acceptBiomass(self, biomassOffered):
 		self.biomass += biomassOffered
 		return biomassOffered
 	
@@ -624,94 +889,65 @@ class Internode(TreePart):
 		return mineralsOffered
 	
 	def reproduce(self):
-		if not self.root:
-			sendSignalTo = []
-			sendSignalTo.extend([self.apicalMeristem])
-			sendSignalTo.extend(self.axillaryMeristems)
-			sendSignalTo.extend([self.child])
-			sendSignalTo.extend(self.branches)
-			for sendTo in sendSignalTo:
-				if sendTo:
-					sendTo.reproduce()
+		# the meristems from here up hear about it in the same order they get the next-day signal
+		for internode in partsInSignalOrder(self, "nextInternodes"):
+			if not internode.root:
+				sendSignalTo = []
+				sendSignalTo.extend([internode.apicalMeristem])
+				sendSignalTo.extend(internode.axillaryMeristems)
+				for sendTo in sendSignalTo:
+					if sendTo:
+						sendTo.reproduce()
 					
 	def die(self):
 		# When an internode dies, everything that depends on it dies too (which only makes sense).
-		sendSignalTo = []
-		if not self.root:
-			sendSignalTo.extend(self.leafClusters)
-			sendSignalTo.extend(self.flowerClusters)
-			sendSignalTo.extend(self.fruitClusters)
-		sendSignalTo.extend([self.apicalMeristem])
-		sendSignalTo.extend(self.axillaryMeristems)
-		sendSignalTo.extend([self.child])
-		sendSignalTo.extend(self.branches)
-		for sendTo in sendSignalTo:
-			if sendTo:
+		# The internodes themselves just pass it on.
+		for internode in partsInSignalOrder(self, "nextInternodes"):
+			for sendTo in internode.dependents():
 				sendTo.die()
 	
-	def gatherDistributees(self, order):
-		distributees = []
-		for name in order:
-			if name == "leaves":
-				if not self.root:
-					distributees.extend(self.leafClusters)
-			elif name == "flowers":
-				if not self.root:
-					distributees.extend(self.flowerClusters)
-			elif name == "fruits":
-				if not self.root:
-					distributees.extend(self.fruitClusters)
-			elif name == "apical meristems":
-				distributees.extend([self.apicalMeristem])
-			elif name == "axillary meristems":
-				distributees.extend(self.axillaryMeristems)
-			elif name == "child":
-				distributees.extend([self.child])
-			elif name == "branches":
-				distributees.extend(self.branches)
-			elif name == "parent":
-				distributees.extend([self.parent])
-			elif name == "root":
-				if (not self.root) and self.firstOnTree:
-					distributees.extend([self.tree.firstRootInternode])
-			elif name == "above-ground tree":
-				if self.root and self.firstOnTree:
-					distributees.extend([self.tree.firstInternode])
-		return distributees
-				
 	def sumUpStresses(self):
-		totalCount = 0
-		totalLowSunAndShadeStress = 0
-		totalLowWaterStress = 0
-		totalLowMineralStress = 0
-		sendSignalTo = []
-		if not self.root:
-			sendSignalTo.extend(self.leafClusters)
-		sendSignalTo.extend([self.child])
-		sendSignalTo.extend(self.branches)
-		for sendTo in sendSignalTo:
-			if sendTo:
+		# Each internode adds up its leaf clusters, then what its child and branches added up to.
+		# Going through the internodes backwards from the order the signal reaches them means
+		# the child and branches of each internode have always been added up before it is.
+		subtotals = {}
+		for internode in reversed(list(partsInSignalOrder(self, "nextInternodes"))):
+			totalCount = 0
+			totalLowSunAndShadeStress = 0
+			totalLowWaterStress = 0
+			totalLowMineralStress = 0
+			sendSignalTo = []
+			if not internode.root:
+				sendSignalTo.extend(internode.leafClusters)
+			for sendTo in sendSignalTo:
 				count, lowSunAndShadeStress, lowWaterStress, lowMineralStress = sendTo.sumUpStresses()
 				totalCount += count
 				totalLowSunAndShadeStress += lowSunAndShadeStress
 				totalLowWaterStress += lowWaterStress
 				totalLowMineralStress += lowMineralStress
-		return totalCount, totalLowSunAndShadeStress, totalLowWaterStress, totalLowMineralStress
+			for sendTo in internode.nextInternodes():
+				count, lowSunAndShadeStress, lowWaterStress, lowMineralStress = subtotals.pop(sendTo)
+				totalCount += count
+				totalLowSunAndShadeStress += lowSunAndShadeStress
+				totalLowWaterStress += lowWaterStress
+				totalLowMineralStress += lowMineralStress
+			subtotals[internode] = totalCount, totalLowSunAndShadeStress, totalLowWaterStress, totalLowMineralStress
+		return subtotals[self]
 		
 	def describe(self, outputFile, indentCounter=0):
-		TreePart.describe(self, outputFile, indentCounter)
-		sendSignalTo = []
-		sendSignalTo.extend(self.branches)
-		if not self.root:
-			sendSignalTo.extend(self.leafClusters)
-			sendSignalTo.extend(self.flowerClusters)
-			sendSignalTo.extend(self.fruitClusters)
-		sendSignalTo.extend([self.apicalMeristem])
-		sendSignalTo.extend(self.axillaryMeristems)
-		sendSignalTo.extend([self.child])
-		for sendTo in sendSignalTo:
-			if sendTo:
-				sendTo.describe(outputFile, indentCounter+1)
+		# each part is followed by its branches, dependents and child, one indent in
+		partsToDescribe = [(self, indentCounter)]
+		while partsToDescribe:
+			part, indentCounter = partsToDescribe.pop()
+			TreePart.describe(part, outputFile, indentCounter)
+			if isinstance(part, Internode):
+				sendSignalTo = []
+				sendSignalTo.extend(part.branches)
+				sendSignalTo.extend(part.dependents())
+				sendSignalTo.extend([part.child])
+				for sendTo in reversed(sendSignalTo):
+					if sendTo:
+						partsToDescribe.append((sendTo, indentCounter+1))
 			
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 class LeafCluster(TreePart):
@@ -728,6 +964,21 @@ class LeafCluster(TreePart):
 
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
+	__slots__ = ("numberOnParentInternode", "randomSway", "spineEndLocation",
+				"newBiomass", "lowSunAndShadeStress", "lowWaterStress", "lowMineralStress",
+				"senescenceFactor", "lowSunStress", "numBlocksShadingMe", "shadeStress", 
+				"lowSunAndShadeStressFactor", "lowWaterStressFactor", "lowMineralStressFactor", "lowBiomassStressFactor", 
+				"combinedEffects")
+	stateFields = TreePart.stateFields + ("length",)
+	describeFields = TreePart.describeFields + ("numberOnParentInternode", "length", "randomSway", "spineEndLocation",
+				"newBiomass", "lowSunAndShadeStress", "lowWaterStress", "lowMineralStress",
+				"senescenceFactor", "lowSunStress", "numBlocksShadingMe", "shadeStress", 
+				"lowSunAndShadeStressFactor", "lowWaterStressFactor", "lowMineralStressFactor", "lowBiomassStressFactor", 
+				"combinedEffects")
+	typeName = "LeafCluster"
+	typeCode = 2
+	dayPhases = DAY_PHASES
+
 	def __init__(self, tree, parent, numberOnParentInternode, matrix):
 		TreePart.__init__(self, tree, parent, matrix, biomass=START_LEAF_CLUSTER_BIOMASS, water=0, minerals=0)
 		self.numberOnParentInternode = numberOnParentInternode
@@ -747,22 +998,14 @@ class LeafCluster(TreePart):
 	# -------------------------------------------------------------------------------------------
 		
 	def nextDay_Uptake(self):
+		if self.tree.batchLeafUptake:
+			return # the tree does this for all its leaf clusters at once (see leafClusterUptake)
 		if self.alive:
-			if self.age >= LEAF_SENESCENCE_BEGINS_AT_AGE:
-				ageOverSenescenceStart = self.age - LEAF_SENESCENCE_BEGINS_AT_AGE
-				if ageOverSenescenceStart < LEAF_SENESCENCE_LASTS:
-					self.senescenceFactor = 1.0 * ageOverSenescenceStart / LEAF_SENESCENCE_LASTS
-				else:
-					self.senescenceFactor = 0.0
-			else:
-				self.senescenceFactor = 1.0
+			self.senescenceFactor = self.calculateSenescenceFactor()
 			if self.senescenceFactor > 0:
 				x = int(round(self.spineEndLocation.x))
 				y = int(round(self.spineEndLocation.y))
-				if sun.has_key((x,y)):
-					sunAtEndOfLeafCluster = sun[(x,y)]
-				else:
-					sunAtEndOfLeafCluster = 0.0
+				sunAtEndOfLeafCluster = self.tree.world.sunAt(x, y)
 				
 				# This equation (e to the minus pi times the factor) just generates
 				# a strong non-linear (sort of arc-shaped) reaction to each factor.
@@ -774,19 +1017,20 @@ class LeafCluster(TreePart):
 				# However, if it is too tricky to grow trees using this method a linear
 				# option might be worth adding.
 				self.lowSunStress = math.exp(-math.pi * sunAtEndOfLeafCluster)
-				self.numBlocksShadingMe = 1.0 - blocksOccupiedAboveLocation(self.matrix.location, self)
+				self.numBlocksShadingMe = 1.0 - self.tree.world.blocksOccupiedAboveLocation(self.matrix.location, self)
 				if NUM_BLOCKS_ABOVE_FOR_MAX_SHADE_STRESS > 0:
 					proportionOfMaxShade = max(0.0, min(1.0, 1.0 * self.numBlocksShadingMe / NUM_BLOCKS_ABOVE_FOR_MAX_SHADE_STRESS))
 				else:
 					proportionOfMaxShade = 0.0
 				self.shadeStress = 1.0 - math.exp(-math.pi * proportionOfMaxShade)
-				self.lowSunAndShadeStress = max(0.0, min(1.0, self.lowSunStress + self.shadeStress))
+				lowSunAndShadeStress = max(0.0, min(1.0, self.lowSunStress + self.shadeStress))
 				
 				proportionOfOptimalWater = max(0.0, min(1.0, self.water / WATER_FOR_OPTIMAL_PHOTOSYNTHESIS))
-				self.lowWaterStress = math.exp(-math.pi * proportionOfOptimalWater)
+				lowWaterStress = math.exp(-math.pi * proportionOfOptimalWater)
 				
 				proportionOfOptimalMinerals = max(0.0, min(1.0, self.minerals / MINERALS_FOR_OPTIMAL_PHOTOSYNTHESIS))
-				self.lowMineralStress = math.exp(-math.pi * proportionOfOptimalMinerals)
+				lowMineralStress = math.exp(-math.pi * proportionOfOptimalMinerals)
+				self.setStresses(lowSunAndShadeStress, lowWaterStress, lowMineralStress)
 				
 				proportionOfOptimalBiomass = max(0.0, min(1.0, self.biomass / OPTIMAL_LEAF_CLUSTER_BIOMASS))
 				lowBiomassFactor = math.exp(-math.pi * proportionOfOptimalBiomass)
@@ -829,49 +1073,76 @@ class LeafCluster(TreePart):
 			self.length = LEAF_CLUSTER_LENGTH_AT_CREATION + proportion * (LEAF_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE - LEAF_CLUSTER_LENGTH_AT_CREATION)
 			self.length = max(LEAF_CLUSTER_LENGTH_AT_CREATION, min(LEAF_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE, self.length))
 		
-	def nextDay_BlockOccupation(self):
+	def attachment(self):
 		if DRAW_LEAF_CLUSTERS:
-			self.matrix = self.parent.matrixForLeafCluster(self.numberOnParentInternode, self.randomSway)
-			if self.length > 1:
-				self.spineEndLocation = self.matrix.calculateMove(self.length)
-				spine = locationsBetweenTwoPoints(self.matrix.location, self.spineEndLocation, self.length)
-				sizeProportion = 1.0 * self.length / LEAF_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE
-				wings = locationsForShapeAroundSpine(spine, LEAF_CLUSTER_SHAPE_PATTERN, LEAF_CLUSTER_SIDES, sizeProportion, 
-													LEAF_CLUSTERS_ARE_HOLLOW, self.matrix)
-				self.claimStartBlock()
-				self.claimSeriesOfBlocks(spine)
-				self.claimSeriesOfBlocks(wings)
-			else:
-				self.claimStartBlock()
+			return self.parent.attachmentForLeafCluster(self.numberOnParentInternode, self.randomSway)
+		return None
+		
+	def claimBlocks(self):
+		if DRAW_LEAF_CLUSTERS:
+			if self.startClaimingBlocks((self.matrix.asTuple(), self.length)):
+				if self.length > 1:
+					self.spineEndLocation = self.matrix.calculateMove(self.length)
+					sizeProportion = 1.0 * self.length / LEAF_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE
+					shape = self.tree.world.clusterShapes.voxelsForShape(self.matrix, self.length, LEAF_CLUSTER_SHAPE_PATTERN, 
+														LEAF_CLUSTER_SIDES, sizeProportion, LEAF_CLUSTERS_ARE_HOLLOW)
+					self.claimStartBlock()
+					self.claimVoxels(shape)
+				else:
+					self.claimStartBlock()
+				self.finishClaimingBlocks()
 
 	# -------------------------------------------------------------------------------------------
 	# methods used by next day methods
 	# -------------------------------------------------------------------------------------------
 		
-	def acceptBiomass(self, biomassOffered):
-		if self.alive:
-			biomassINeed = max(0, (OPTIMAL_LEAF_CLUSTER_BIOMASS + BIOMASS_USED_BY_LEAF_CLUSTER_PER_DAY) - self.biomass)
+	def setStresses(self, lowSunAndShadeStress, lowWaterStress, lowMineralStress):
+		# the tree keeps running totals of these (see Tree.calculateStresses)
+		tree = self.tree
+		tree.totalLowSunAndShadeStress += lowSunAndShadeStress - self.lowSunAndShadeStress
+		tree.totalLowWaterStress += lowWaterStress - self.lowWaterStress
+		tree.totalLowMineralStress += lowMineralStress - self.lowMineralStress
+		self.lowSunAndShadeStress = lowSunAndShadeStress
+		self.lowWaterStress = lowWaterStress
+		self.lowMineralStress = lowMineralStress
+		
+	def calculateSenescenceFactor(self):
+		if self.age >= LEAF_SENESCENCE_BEGINS_AT_AGE:
+			ageOverSenescenceStart = self.age - LEAF_SENESCENCE_BEGINS_AT_AGE
+			if ageOverSenescenceStart < LEAF_SENESCENCE_LASTS:
+				return 1.0 * ageOverSenescenceStart / LEAF_SENESCENCE_LASTS
+			else:
+				return 0.0
 		else:
-			biomassINeed = 0
-		biomassIWillAccept = min(biomassOffered, biomassINeed)
+			return 1.0
+		
+	def biomassINeed(self):
+		if self.alive:
+			return max(0, (OPTIMAL_LEAF_CLUSTER_BIOMASS + BIOMASS_USED_BY_LEAF_CLUSTER_PER_DAY) - self.biomass)
+		return 0
+	
+	def waterINeed(self):
+		if self.alive:
+			return max(0, WATER_FOR_OPTIMAL_PHOTOSYNTHESIS - self.water)
+		return 0
+	
+	def mineralsINeed(self):
+		if self.alive:
+			return max(0, MINERALS_FOR_OPTIMAL_PHOTOSYNTHESIS - self.minerals)
+		return 0
+	
+	def acceptBiomass(self, biomassOffered):
+		biomassIWillAccept = min(biomassOffered, self.biomassINeed())
 		self.biomass += biomassIWillAccept
 		return biomassIWillAccept
 		
 	def acceptWater(self, waterOffered):
-		if self.alive:
-			waterINeed = max(0, WATER_FOR_OPTIMAL_PHOTOSYNTHESIS - self.water)
-		else:
-			waterINeed = 0
-		waterIWillAccept = min(waterOffered, waterINeed)
+		waterIWillAccept = min(waterOffered, self.waterINeed())
 		self.water += waterIWillAccept
 		return waterIWillAccept
 	
 	def acceptMinerals(self, mineralsOffered):
-		if self.alive:
-			mineralsINeed = max(0, MINERALS_FOR_OPTIMAL_PHOTOSYNTHESIS - self.minerals)
-		else:
-			mineralsINeed = 0
-		mineralsIWillAccept = min(mineralsOffered, mineralsINeed)
+		mineralsIWillAccept = min(mineralsOffered, self.mineralsINeed())
 		self.minerals += mineralsIWillAccept
 		return mineralsIWillAccept
 	
@@ -887,6 +1158,13 @@ class FlowerCluster(TreePart):
 
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
+	__slots__ = ("numberOnParentInternode", "apical", "randomSway")
+	stateFields = TreePart.stateFields + ("length",)
+	describeFields = TreePart.describeFields + ("numberOnParentInternode", "apical", "length", "randomSway")
+	typeName = "FlowerCluster"
+	typeCode = 3
+	dayPhases = ("nextDay_Consumption", "nextDay_Growth", "nextDay_BlockOccupation", "nextDay_Aging")
+
 	def __init__(self, tree, parent, numberOnParentInternode, apical, matrix):
 		TreePart.__init__(self, tree, parent, matrix, biomass=START_FLOWER_CLUSTER_BIOMASS, water=0, minerals=0)
 		self.numberOnParentInternode = numberOnParentInternode
@@ -903,6 +1181,7 @@ class FlowerCluster(TreePart):
 		
 	def buildFruit(self):
 		newFruitCluster = FruitCluster(self.tree, self.parent, self.numberOnParentInternode, self.matrix)
+		self.tree.partWentAway(self)
 		self.parent.removeFlowerClusterThatMadeFruitCluster(self)
 		self.parent.addFruitCluster(newFruitCluster)
 				
@@ -924,31 +1203,35 @@ class FlowerCluster(TreePart):
 			self.length = FLOWER_CLUSTER_LENGTH_AT_CREATION + proportion * (FLOWER_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE - FLOWER_CLUSTER_LENGTH_AT_CREATION)
 			self.length = max(FLOWER_CLUSTER_LENGTH_AT_CREATION, min(FLOWER_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE, self.length))
 		
-	def nextDay_BlockOccupation(self):
+	def attachment(self):
 		if DRAW_FLOWER_CLUSTERS:
-			self.matrix = self.parent.matrixForFlowerCluster(self.numberOnParentInternode, self.randomSway)
-			if self.length > 1:
-				spineEndLocation = self.matrix.calculateMove(self.length)
-				spine = locationsBetweenTwoPoints(self.matrix.location, spineEndLocation, self.length)
-				sizeProportion = 1.0 * self.length / FLOWER_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE
-				wings = locationsForShapeAroundSpine(spine, FLOWER_CLUSTER_SHAPE_PATTERN, FLOWER_CLUSTER_SIDES, sizeProportion, 
-													FLOWER_CLUSTERS_ARE_HOLLOW, self.matrix)
-				self.claimStartBlock()
-				self.claimSeriesOfBlocks(spine)
-				self.claimSeriesOfBlocks(wings)
-			else:
-				self.claimStartBlock()
+			return self.parent.attachmentForFlowerCluster(self.numberOnParentInternode, self.randomSway)
+		return None
+		
+	def claimBlocks(self):
+		if DRAW_FLOWER_CLUSTERS:
+			if self.startClaimingBlocks((self.matrix.asTuple(), self.length)):
+				if self.length > 1:
+					sizeProportion = 1.0 * self.length / FLOWER_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE
+					shape = self.tree.world.clusterShapes.voxelsForShape(self.matrix, self.length, FLOWER_CLUSTER_SHAPE_PATTERN, 
+														FLOWER_CLUSTER_SIDES, sizeProportion, FLOWER_CLUSTERS_ARE_HOLLOW)
+					self.claimStartBlock()
+					self.claimVoxels(shape)
+				else:
+					self.claimStartBlock()
+				self.finishClaimingBlocks()
 
 	# -------------------------------------------------------------------------------------------
 	# methods used by next day methods
 	# -------------------------------------------------------------------------------------------
 		
-	def acceptBiomass(self, biomassOffered):
+	def biomassINeed(self):
 		if self.alive:
-			biomassINeed = max(0, (OPTIMAL_FLOWER_CLUSTER_BIOMASS + BIOMASS_USED_BY_FLOWER_CLUSTER_PER_DAY) - self.biomass)
-		else:
-			biomassINeed = 0
-		biomassIWillAccept = min(biomassOffered, biomassINeed)
+			return max(0, (OPTIMAL_FLOWER_CLUSTER_BIOMASS + BIOMASS_USED_BY_FLOWER_CLUSTER_PER_DAY) - self.biomass)
+		return 0
+	
+	def acceptBiomass(self, biomassOffered):
+		biomassIWillAccept = min(biomassOffered, self.biomassINeed())
 		self.biomass += biomassIWillAccept
 		return biomassIWillAccept
 		
@@ -960,6 +1243,13 @@ class FruitCluster(TreePart):
 
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
+	__slots__ = ("numberOnParentInternode", "randomSway")
+	stateFields = TreePart.stateFields + ("length",)
+	describeFields = TreePart.describeFields + ("numberOnParentInternode", "length", "randomSway")
+	typeName = "FruitCluster"
+	typeCode = 4
+	dayPhases = ("nextDay_Consumption", "nextDay_Growth", "nextDay_BlockOccupation", "nextDay_Aging")
+
 	def __init__(self, tree, parent, numberOnParentInternode, matrix):
 		TreePart.__init__(self, tree, parent, matrix, biomass=START_FRUIT_CLUSTER_BIOMASS, water=0, minerals=0)
 		self.numberOnParentInternode = numberOnParentInternode
@@ -985,48 +1275,467 @@ class FruitCluster(TreePart):
 			self.length = FRUIT_CLUSTER_LENGTH_AT_CREATION + proportion * (FRUIT_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE - FRUIT_CLUSTER_LENGTH_AT_CREATION)
 			self.length = max(FRUIT_CLUSTER_LENGTH_AT_CREATION, min(FRUIT_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE, self.length))
 		
-	def nextDay_BlockOccupation(self):
+	def attachment(self):
 		if DRAW_FRUIT_CLUSTERS:
-			self.matrix = self.parent.matrixForFruitCluster(self.numberOnParentInternode, self.randomSway)
-			if self.length > 1:
-				spineEndLocation = self.matrix.calculateMove(self.length)
-				spine = locationsBetweenTwoPoints(self.matrix.location, spineEndLocation, self.length)
-				sizeProportion = 1.0 * self.length / FRUIT_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE
-				wings = locationsForShapeAroundSpine(spine, FRUIT_CLUSTER_SHAPE_PATTERN, FRUIT_CLUSTER_SIDES, sizeProportion, 
-													FRUIT_CLUSTERS_ARE_HOLLOW, self.matrix)
-				self.claimStartBlock()
-				self.claimSeriesOfBlocks(spine)
-				self.claimSeriesOfBlocks(wings)
-			else:
-				self.claimStartBlock()
+			return self.parent.attachmentForFruitCluster(self.numberOnParentInternode, self.randomSway)
+		return None
+		
+	def claimBlocks(self):
+		if DRAW_FRUIT_CLUSTERS:
+			if self.startClaimingBlocks((self.matrix.asTuple(), self.length)):
+				if self.length > 1:
+					sizeProportion = 1.0 * self.length / FRUIT_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE
+					shape = self.tree.world.clusterShapes.voxelsForShape(self.matrix, self.length, FRUIT_CLUSTER_SHAPE_PATTERN, 
+														FRUIT_CLUSTER_SIDES, sizeProportion, FRUIT_CLUSTERS_ARE_HOLLOW)
+					self.claimStartBlock()
+					self.claimVoxels(shape)
+				else:
+					self.claimStartBlock()
+				self.finishClaimingBlocks()
 
 	# -------------------------------------------------------------------------------------------
 	# methods used by next day methods
 	# -------------------------------------------------------------------------------------------
 		
-	def acceptBiomass(self, biomassOffered):
+	def biomassINeed(self):
 		if self.alive:
-			biomassINeed = max(0, (OPTIMAL_FRUIT_CLUSTER_BIOMASS + BIOMASS_USED_BY_FRUIT_CLUSTER_PER_DAY) - self.biomass)
-		else:
-			biomassINeed
-		biomassIWillAccept = min(biomassOffered, biomassINeed)
+			return max(0, (OPTIMAL_FRUIT_CLUSTER_BIOMASS + BIOMASS_USED_BY_FRUIT_CLUSTER_PER_DAY) - self.biomass)
+		return 0
+	
+	def acceptBiomass(self, biomassOffered):
+		biomassIWillAccept = min(biomassOffered, self.biomassINeed())
 		self.biomass += biomassIWillAccept
 		return biomassIWillAccept
 				
+# The parts of a tree that doesn't keep their state in arrays keep it in their own slots.
+
+class MeristemFields(Meristem):
+	__slots__ = Meristem.stateFields
+	
+class InternodeFields(Internode):
+	__slots__ = Internode.stateFields
+	
+class LeafClusterFields(LeafCluster):
+	__slots__ = LeafCluster.stateFields
+	
+class FlowerClusterFields(FlowerCluster):
+	__slots__ = FlowerCluster.stateFields
+	
+class FruitClusterFields(FruitCluster):
+	__slots__ = FruitCluster.stateFields
+	
+Meristem.fieldsClass = MeristemFields
+Internode.fieldsClass = InternodeFields
+LeafCluster.fieldsClass = LeafClusterFields
+FlowerCluster.fieldsClass = FlowerClusterFields
+FruitCluster.fieldsClass = FruitClusterFields
+
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+# Photosynthesis for many leaf clusters at once (see Tree.__init__).
+# This does the same thing as LeafCluster.nextDay_Uptake, for each leaf cluster in the list,
+# so the two should be changed together. The leaf clusters can come from any trees in the world.
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def senescenceFactors(ages):
+	# the same as LeafCluster.calculateSenescenceFactor, for an array of ages
+	ageOverSenescenceStart = ages - LEAF_SENESCENCE_BEGINS_AT_AGE
+	result = np.where(ageOverSenescenceStart < LEAF_SENESCENCE_LASTS, 1.0 * ageOverSenescenceStart / LEAF_SENESCENCE_LASTS, 0.0)
+	return np.where(ageOverSenescenceStart >= 0, result, 1.0)
+
+def leafClusterUptake(world, leafClusters):
+	for leafCluster in leafClusters:
+		if not leafCluster.alive:
+			leafCluster.newBiomass = 0
+	leafClusters = [leafCluster for leafCluster in leafClusters if leafCluster.alive]
+	if not leafClusters:
+		return
+	senescenceFactor = senescenceFactors(np.array([leafCluster.age for leafCluster in leafClusters]))
+	for leafCluster, factor in zip(leafClusters, senescenceFactor.tolist()):
+		leafCluster.senescenceFactor = factor
+	# leaf clusters that have stopped photosynthesizing keep what they had the day before
+	leafClusters = [leafCluster for leafCluster, factor in zip(leafClusters, senescenceFactor.tolist()) if factor > 0]
+	senescenceFactor = senescenceFactor[senescenceFactor > 0]
+	if not leafClusters:
+		return
+	spineEnds = voxelsForLocations([leafCluster.spineEndLocation for leafCluster in leafClusters])
+	sunAtEndOfLeafCluster = world.sunAtColumns(spineEnds[:, 0], spineEnds[:, 1])
+	numBlocksShadingMe = 1.0 - np.array([world.blocksOccupiedAboveLocation(leafCluster.matrix.location, leafCluster) 
+		for leafCluster in leafClusters], dtype=float)
+	# these are divided one at a time so that new leaf clusters, whose amounts are still whole numbers, 
+	# come out the same as they do in LeafCluster.nextDay_Uptake
+	proportionOfOptimalWater = np.array([leafCluster.water / WATER_FOR_OPTIMAL_PHOTOSYNTHESIS for leafCluster in leafClusters], dtype=float)
+	proportionOfOptimalMinerals = np.array([leafCluster.minerals / MINERALS_FOR_OPTIMAL_PHOTOSYNTHESIS for leafCluster in leafClusters], dtype=float)
+	proportionOfOptimalBiomass = np.array([leafCluster.biomass / OPTIMAL_LEAF_CLUSTER_BIOMASS for leafCluster in leafClusters], dtype=float)
+	
+	lowSunStress = np.exp(-np.pi * sunAtEndOfLeafCluster)
+	if NUM_BLOCKS_ABOVE_FOR_MAX_SHADE_STRESS > 0:
+		proportionOfMaxShade = np.clip(1.0 * numBlocksShadingMe / NUM_BLOCKS_ABOVE_FOR_MAX_SHADE_STRESS, 0.0, 1.0)
+	else:
+		proportionOfMaxShade = np.zeros(len(leafClusters))
+	shadeStress = 1.0 - np.exp(-np.pi * proportionOfMaxShade)
+	lowSunAndShadeStress = np.clip(lowSunStress + shadeStress, 0.0, 1.0)
+	lowWaterStress = np.exp(-np.pi * np.clip(proportionOfOptimalWater, 0.0, 1.0))
+	lowMineralStress = np.exp(-np.pi * np.clip(proportionOfOptimalMinerals, 0.0, 1.0))
+	lowBiomassFactor = np.exp(-np.pi * np.clip(proportionOfOptimalBiomass, 0.0, 1.0))
+	
+	lowSunAndShadeStressFactor = lowSunAndShadeStress * 0.25 * (1.0 - LOW_SUN_AND_SHADE_TOLERANCE)
+	lowWaterStressFactor = lowWaterStress * 0.25 * (1.0 - WATER_STRESS_TOLERANCE)
+	lowMineralStressFactor = lowMineralStress * 0.25 * (1.0 - MINERAL_STRESS_TOLERANCE)
+	lowBiomassStressFactor = lowBiomassFactor * 0.25
+	combinedEffects = 1.0 - (lowSunAndShadeStressFactor + lowWaterStressFactor + lowMineralStressFactor + lowBiomassStressFactor)
+	combinedEffects = np.clip(combinedEffects * senescenceFactor, 0.0, 1.0)
+	newBiomass = combinedEffects * OPTIMAL_DAILY_PHOTOSYNTHATE
+	
+	# the leaf clusters keep what went into their photosynthesis for the report (see LeafCluster.nextDay_Uptake)
+	for name, values in [("lowSunStress", lowSunStress), ("numBlocksShadingMe", numBlocksShadingMe), ("shadeStress", shadeStress),
+			("lowSunAndShadeStressFactor", lowSunAndShadeStressFactor), ("lowWaterStressFactor", lowWaterStressFactor),
+			("lowMineralStressFactor", lowMineralStressFactor), ("lowBiomassStressFactor", lowBiomassStressFactor),
+			("combinedEffects", combinedEffects)]:
+		for leafCluster, value in zip(leafClusters, values.tolist()):
+			setattr(leafCluster, name, value)
+	for leafCluster, sunAndShade, water, minerals, made in zip(leafClusters, lowSunAndShadeStress.tolist(),
+			lowWaterStress.tolist(), lowMineralStress.tolist(), newBiomass.tolist()):
+		leafCluster.setStresses(sunAndShade, water, minerals)
+		leafCluster.newBiomass = made
+		leafCluster.biomass += made
+		
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+# Moving biomass, water or minerals through a whole tree at once (see Tree.transportResources).
+# The graph is kept as three arrays with one entry for each edge (source node, target node, weight),
+# and the sums over edges are done with np.bincount, which is a sparse matrix-vector multiply in all but name.
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+def transportAlongGraph(amounts, room, kept, sources, targets, weights, numRounds):
+	# The sources are the first len(kept) nodes. In each round every source offers each of its edges the edge's weight
+	# times what it has over what it keeps, all at once; a node offered more than it has room for takes
+	# the same share of each offer, and what isn't taken stays where it was. Changes amounts and room in place.
+	numNodes = len(amounts)
+	numSources = len(kept)
+	for i in range(numRounds):
+		extra = np.maximum(amounts[:numSources] - kept, 0.0)
+		offered = weights * extra[sources]
+		offeredToNode = np.bincount(targets, weights=offered, minlength=numNodes)
+		shareTaken = np.ones(numNodes)
+		tooMuch = offeredToNode > room
+		shareTaken[tooMuch] = room[tooMuch] / offeredToNode[tooMuch]
+		taken = offered * shareTaken[targets]
+		if not taken.any():
+			break
+		takenByNode = np.bincount(targets, weights=taken, minlength=numNodes)
+		amounts -= np.bincount(sources, weights=taken, minlength=numNodes)
+		amounts += takenByNode
+		room[:] = np.maximum(room - takenByNode, 0.0)
+
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+class PartStateArrays(object):
+	
+# When a tree keeps the state of its parts in arrays (see ARRAY_PART_STATE), this is where it lives:
+# one row for each part the tree has ever made, in the order they were made, with the kind of part
+# (its typeCode) and the row of its parent internode. Rows are never given back; a part that goes away
+# (a meristem that turned into an internode, a flower cluster that turned into a fruit cluster)
+# is just marked as not attached. The parts themselves become thin views that read and write their rows,
+# and the consumption, growth and aging of all the parts happen in a few array operations each day.
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+	fieldTypes = (("typeCode", np.int8), ("parent", np.int64), ("child", np.int64), ("attached", bool),
+		("age", np.int64), ("alive", bool), ("biomass", float), ("water", float), ("minerals", float),
+		("length", float), ("width", float), ("woody", bool), ("root", bool), ("firstOnTree", bool),
+		("branchNestingLevel", np.int64), ("senescence", float))
+	
+	def __init__(self, capacity=64):
+		self.parts = []
+		self.numRows = 0
+		for name, fieldType in self.fieldTypes:
+			setattr(self, name, np.zeros(capacity, dtype=fieldType))
+			
+	def __str__(self):
+		return "%d rows" % self.numRows
+			
+	def addRow(self, part, parent):
+		if self.numRows == len(self.typeCode):
+			for name, fieldType in self.fieldTypes:
+				array = getattr(self, name)
+				setattr(self, name, np.concatenate((array, np.zeros(len(array), dtype=fieldType))))
+		row = self.numRows
+		self.numRows += 1
+		self.parts.append(part)
+		self.typeCode[row] = part.typeCode
+		if parent is not None:
+			self.parent[row] = parent.row
+		else:
+			self.parent[row] = -1
+		self.child[row] = -1
+		self.attached[row] = True
+		return row
+	
+	def rowsOfType(self, partClass, numRows):
+		return (self.typeCode[:numRows] == partClass.typeCode) & self.attached[:numRows]
+	
+	def calculateSenescence(self):
+		# how much the leaf clusters photosynthesize for their age (see LeafCluster.calculateSenescenceFactor)
+		leafClusters = self.rowsOfType(LeafCluster, self.numRows)
+		self.senescence[:self.numRows][leafClusters] = senescenceFactors(self.age[:self.numRows][leafClusters])
+		
+	def consume(self, numRows):
+		# Maintenance respiration for all the parts in the first numRows rows, except meristems, which use up
+		# biomass as they take up the day signal (see Meristem.nextDay_Uptake). Parts whose biomass would fall
+		# too low die instead. Returns which of the internodes died (as a mask over the rows), since they have to
+		# pass it on (see passOnDeath), and the rows of the other parts that died, which are already marked as dead.
+		biomass = self.biomass[:numRows]
+		alive = self.alive[:numRows]
+		root = self.root[:numRows]
+		internodes = self.rowsOfType(Internode, numRows) & alive
+		leafClusters = self.rowsOfType(LeafCluster, numRows) & alive
+		flowerClusters = self.rowsOfType(FlowerCluster, numRows)
+		fruitClusters = self.rowsOfType(FruitCluster, numRows)
+		used = np.zeros(numRows)
+		used[internodes] = np.where(self.woody[:numRows], 0.0, np.asarray(BIOMASS_USED_BY_INTERNODE_PER_DAY)[root.astype(int)])[internodes]
+		used[leafClusters] = BIOMASS_USED_BY_LEAF_CLUSTER_PER_DAY
+		used[flowerClusters] = BIOMASS_USED_BY_FLOWER_CLUSTER_PER_DAY
+		used[fruitClusters] = BIOMASS_USED_BY_FRUIT_CLUSTER_PER_DAY
+		diesBelow = np.zeros(numRows)
+		diesBelow[internodes] = np.asarray(INTERNODE_DIES_IF_BIOMASS_GOES_BELOW)[root.astype(int)][internodes]
+		diesBelow[leafClusters] = LEAF_CLUSTER_DIES_IF_BIOMASS_GOES_BELOW
+		diesBelow[flowerClusters] = FLOWER_CLUSTER_DIES_IF_BIOMASS_GOES_BELOW
+		diesBelow[fruitClusters] = FRUIT_CLUSTER_DIES_IF_BIOMASS_GOES_BELOW
+		consuming = internodes | leafClusters | flowerClusters | fruitClusters
+		dying = consuming & (biomass - used < diesBelow)
+		biomass[consuming & ~dying] -= used[consuming & ~dying]
+		# internodes don't die themselves, they just pass it on (see Internode.die)
+		alive[dying & ~internodes] = False
+		return dying & internodes, np.nonzero(dying & ~internodes)[0]
+	
+	def passOnDeath(self, dyingInternodes):
+		# Everything that depends on the dying internodes (given as a mask over the first rows) dies with them,
+		# as in Internode.die: the meristems, and for stem internodes the leaf, flower and fruit clusters,
+		# attached to them or to any internode above them. An internode is above a dying one if its parent is,
+		# or its parent's parent and so on, which is found by following the parents of the internodes
+		# twice as far up each pass. Returns the rows of the parts that died.
+		numRows = self.numRows
+		parent = self.parent[:numRows]
+		internodes = self.typeCode[:numRows] == Internode.typeCode
+		aboveDying = np.zeros(numRows, dtype=bool)
+		aboveDying[:len(dyingInternodes)] = dyingInternodes
+		ancestor = np.where(internodes, parent, -1)
+		hasAncestor = ancestor >= 0
+		while hasAncestor.any():
+			aboveDying[hasAncestor] |= aboveDying[ancestor[hasAncestor]]
+			ancestor[hasAncestor] = ancestor[ancestor[hasAncestor]]
+			hasAncestor = ancestor >= 0
+		dependents = self.attached[:numRows] & ~internodes & (parent >= 0)
+		dependentRows = np.nonzero(dependents)[0]
+		parentRows = parent[dependentRows]
+		dying = aboveDying[parentRows] & ((self.typeCode[dependentRows] == Meristem.typeCode) | ~self.root[parentRows])
+		dyingRows = dependentRows[dying & self.alive[dependentRows]]
+		self.alive[dyingRows] = False
+		return dyingRows
+	
+	def grow(self, numRows):
+		# Growth in size for all the parts in the first numRows rows, except meristems, which make new parts
+		# as they grow (see Meristem.nextDay_Growth). Returns the rows of the flower clusters that are ready
+		# to turn into fruit clusters, which don't grow in size.
+		biomass = self.biomass[:numRows]
+		alive = self.alive[:numRows]
+		root = self.root[:numRows].astype(int)
+		length = self.length[:numRows]
+		width = self.width[:numRows]
+		
+		internodes = self.rowsOfType(Internode, numRows) & alive
+		self.woody[:numRows][internodes] = (self.age[:numRows] > np.asarray(INTERNODES_TURN_WOODY_AFTER_THIS_MANY_DAYS)[root])[internodes]
+		proportion = biomass / np.asarray(OPTIMAL_INTERNODE_BIOMASS)[root]
+		firstOnTree = self.firstOnTree[:numRows]
+		atCreation = np.where(firstOnTree, np.asarray(FIRST_INTERNODE_LENGTH_AT_CREATION)[root], np.asarray(INTERNODE_LENGTH_AT_CREATION)[root])
+		maxLength = np.where(self.branchNestingLevel[:numRows] == 0, 
+			np.asarray(INTERNODE_GROWTH_IN_LENGTH_AT_FULL_SIZE_TRUNK)[root], np.asarray(INTERNODE_GROWTH_IN_LENGTH_AT_FULL_SIZE_BRANCH)[root])
+		maxLength = np.where(firstOnTree, np.asarray(FIRST_INTERNODE_GROWTH_IN_LENGTH_AT_FULL_SIZE)[root], maxLength)
+		newLength = np.maximum(atCreation, np.minimum(maxLength, atCreation + proportion * (maxLength - atCreation)))
+		length[internodes] = newLength[internodes]
+		atCreation = np.asarray(INTERNODE_WIDTH_AT_CREATION)[root]
+		maxWidth = np.asarray(INTERNODE_GROWTH_IN_WIDTH_AT_FULL_SIZE)[root]
+		newWidth = np.maximum(atCreation, np.minimum(maxWidth, atCreation + proportion * (maxWidth - atCreation)))
+		width[internodes] = newWidth[internodes]
+		
+		flowerClusters = self.rowsOfType(FlowerCluster, numRows)
+		makingFruit = flowerClusters & (self.age[:numRows] >= MINIMUM_DAYS_FLOWER_APPEARS_EVEN_WITH_OPTIMAL_BIOMASS) & \
+			(biomass >= OPTIMAL_FLOWER_CLUSTER_BIOMASS)
+		for partClass, growing, optimalBiomass, atCreation, atFullSize in [
+				(LeafCluster, alive, OPTIMAL_LEAF_CLUSTER_BIOMASS, LEAF_CLUSTER_LENGTH_AT_CREATION, LEAF_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE),
+				(FlowerCluster, ~makingFruit, OPTIMAL_FLOWER_CLUSTER_BIOMASS, FLOWER_CLUSTER_LENGTH_AT_CREATION, FLOWER_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE),
+				(FruitCluster, alive, OPTIMAL_FRUIT_CLUSTER_BIOMASS, FRUIT_CLUSTER_LENGTH_AT_CREATION, FRUIT_CLUSTER_GROWTH_IN_LENGTH_AT_FULL_SIZE)]:
+			rows = self.rowsOfType(partClass, numRows) & growing
+			proportion = biomass[rows] / optimalBiomass
+			length[rows] = np.maximum(atCreation, np.minimum(atFullSize, atCreation + proportion * (atFullSize - atCreation)))
+		return np.nonzero(makingFruit)[0].tolist()
+	
+	def growOlder(self, numRows):
+		self.age[:numRows][self.attached[:numRows]] += 1
+
+def partStateProperty(name):
+	# a field of a tree part that lives in its row of the tree's PartStateArrays
+	def getValue(self):
+		return getattr(self.tree.partState, name).item(self.row)
+	def setValue(self, value):
+		getattr(self.tree.partState, name)[self.row] = value
+	return property(getValue, setValue)
+
+class PartStateRow(object):
+	
+# What the tree parts of a tree with PartStateArrays have in common. Their state comes from their rows,
+# and they leave consumption, growth and aging to the tree (see Tree.updatePartState).
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+	__slots__ = ()
+	
+	age = partStateProperty("age")
+	alive = partStateProperty("alive")
+	biomass = partStateProperty("biomass")
+	water = partStateProperty("water")
+	minerals = partStateProperty("minerals")
+	length = partStateProperty("length")
+	width = partStateProperty("width")
+	woody = partStateProperty("woody")
+	root = partStateProperty("root")
+	firstOnTree = partStateProperty("firstOnTree")
+	branchNestingLevel = partStateProperty("branchNestingLevel")
+	
+	def nextDay_ThisPart(self):
+		self.nextDay_Uptake()
+		self.nextDay_Distribution()
+		self.nextDay_Growth()
+		self.nextDay_BlockOccupation()
+		
+	def nextDay_Consumption(self):
+		pass
+	
+	def nextDay_Growth(self):
+		pass
+	
+class MeristemRow(PartStateRow, Meristem):
+	__slots__ = ("row",)
+	dayPhases = ("nextDay_Uptake", "nextDay_Growth", "nextDay_BlockOccupation")
+	
+	def nextDay_Growth(self):
+		# meristems still grow as the day signal reaches them, since they make new parts when they do
+		Meristem.nextDay_Growth(self)
+		
+class InternodeRow(PartStateRow, Internode):
+	__slots__ = ("row",)
+	dayPhases = ("nextDay_Uptake", "nextDay_Distribution", "nextDay_BlockOccupation")
+	
+	def addChildInternode(self, internode):
+		Internode.addChildInternode(self, internode)
+		self.tree.partState.child[self.row] = internode.row
+		
+	def removeMeristemThatMadeInternode(self, meristem):
+		Internode.removeMeristemThatMadeInternode(self, meristem)
+		self.tree.partState.attached[meristem.row] = False
+		
+class LeafClusterRow(PartStateRow, LeafCluster):
+	__slots__ = ("row",)
+	dayPhases = ("nextDay_Uptake", "nextDay_Distribution", "nextDay_BlockOccupation")
+	
+	def calculateSenescenceFactor(self):
+		return self.tree.partState.senescence.item(self.row)
+
+class FlowerClusterRow(PartStateRow, FlowerCluster):
+	__slots__ = ("row",)
+	dayPhases = ("nextDay_BlockOccupation",)
+
+class FruitClusterRow(PartStateRow, FruitCluster):
+	__slots__ = ("row",)
+	dayPhases = ("nextDay_BlockOccupation",)
+	
+Meristem.rowClass = MeristemRow
+Internode.rowClass = InternodeRow
+LeafCluster.rowClass = LeafClusterRow
+FlowerCluster.rowClass = FlowerClusterRow
+FruitCluster.rowClass = FruitClusterRow
+
+PART_CLASSES = (Meristem, Internode, LeafCluster, FlowerCluster, FruitCluster) # in typeCode order
+PHASE_ORDER = (Internode, LeafCluster, FlowerCluster, FruitCluster, Meristem) # as an internode sends the signal on
+
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+class PartRegistry(object):
+	
+# The parts of one kind on one tree, live or dead (see Tree.partsOfType), in the order they were put in.
+# Taking a part out just notes that it is out, and the list drops the parts that are out the next time 
+# someone goes through it, so putting parts in and taking them out are quick however many parts there are.
+# Going through the registry gives the list itself, so make a copy if parts may come and go while you do.
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+	__slots__ = ("parts", "partsTakenOut")
+	
+	def __init__(self):
+		self.parts = []
+		self.partsTakenOut = set()
+		
+	def __repr__(self):
+		return "%d parts" % len(self)
+		
+	def __len__(self):
+		return len(self.parts) - len(self.partsTakenOut)
+	
+	def __iter__(self):
+		if self.partsTakenOut:
+			self.parts = [part for part in self.parts if part not in self.partsTakenOut]
+			self.partsTakenOut = set()
+		return iter(self.parts)
+	
+	def add(self, part):
+		self.parts.append(part)
+		
+	def remove(self, part):
+		self.partsTakenOut.add(part)
+	
+	
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 class Tree():
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
-	def __init__(self, x, y, z):
+	def __init__(self, world, x, y, z, 
+				batchRootUptake=BATCH_ROOT_UPTAKE, batchBlockOccupation=BATCH_BLOCK_OCCUPATION, 
+				batchFramePropagation=BATCH_FRAME_PROPAGATION, arrayPartState=ARRAY_PART_STATE, 
+				batchLeafUptake=BATCH_LEAF_UPTAKE, checkStressTotals=CHECK_STRESS_TOTALS, 
+				solveResourceTransport=SOLVE_RESOURCE_TRANSPORT, transportRoundsPerDay=TRANSPORT_ROUNDS_PER_DAY, 
+				phaseSynchronousDay=PHASE_SYNCHRONOUS_DAY, 
+				phaseSynchronousDayInSignalOrder=PHASE_SYNCHRONOUS_DAY_IN_SIGNAL_ORDER):
+		self.world = world
+		self.batchRootUptake = batchRootUptake
+		self.batchBlockOccupation = batchBlockOccupation
+		self.batchFramePropagation = batchFramePropagation
+		self.arrayPartState = arrayPartState
+		self.batchLeafUptake = batchLeafUptake
+		self.checkStressTotals = checkStressTotals
+		self.solveResourceTransport = solveResourceTransport
+		self.transportRoundsPerDay = transportRoundsPerDay
+		self.phaseSynchronousDay = phaseSynchronousDay
+		self.phaseSynchronousDayInSignalOrder = phaseSynchronousDayInSignalOrder
 		self.age = 0
 		self.numInternodesCreated = 0
 		self.numRootInternodesCreated = 0
 		self.reproductivePhaseHasStarted = False
 		self.prevailingStressCondition = "no stress"
+		# running totals of the stresses of all the leaf clusters, which they keep up to date (see LeafCluster.setStresses)
+		self.totalLowSunAndShadeStress = 0
+		self.totalLowWaterStress = 0
+		self.totalLowMineralStress = 0
 		
 		self.seed = random.random()
 		random.seed(self.seed)
 		
+		self.occupationBatch = None # only while a day's blocks are being collected
+		self.partsToPosition = None # only while a day's parts are being collected (see BATCH_FRAME_PROPAGATION)
+		if self.arrayPartState:
+			self.partState = PartStateArrays()
+		else:
+			self.partState = None
+		# all the parts of the tree by kind (typeCode), live and dead apart, kept up to date 
+		# as parts are made, die and go away (see partsOfType)
+		self.liveParts = [PartRegistry() for partClass in PART_CLASSES]
+		self.deadParts = [PartRegistry() for partClass in PART_CLASSES]
+		# internodes never die themselves, they only pass it on (see Internode.die), so there are no dead ones to keep
+		self.deadParts[Internode.typeCode] = None
+		
 		self.trunkMatrix = Matrix3D(0.0, 0.0, 0.0)
 		self.trunkMatrix.initializeAsUnitMatrix()
 		self.trunkMatrix.setLocation(x, y, z)
@@ -1038,24 +1747,247 @@ class Tree():
 
 		firstMeristem = Meristem(self, None, False, 0, 0, self.trunkMatrix, apical=True)
 		self.firstInternode = firstMeristem.buildInternode(firstOnTree=True)
+		self.partWentAway(firstMeristem)
 		
 		firstRootMeristem = Meristem(self, None, True, 0, 0, self.rootMatrix, apical=True)
 		self.firstRootInternode = firstRootMeristem.buildInternode(firstOnTree=True)
+		self.partWentAway(firstRootMeristem)
 		
 	def nextDay(self):
 		if self.age == REPRODUCTIVE_MODE_STARTS_ON_DAY:
 			self.reproductivePhaseHasStarted = True
 			self.firstInternode.reproduce()
-		self.firstInternode.nextDay()
-		self.firstRootInternode.nextDay()
+		if self.batchRootUptake:
+			self.rootUptake()
+		if self.solveResourceTransport:
+			self.transportResources()
+		if self.batchLeafUptake:
+			leafClusters = list(self.partsOfType(LeafCluster))
+			leafClusters.extend(self.partsOfType(LeafCluster, alive=False))
+			leafClusterUptake(self.world, leafClusters)
+		if self.batchBlockOccupation:
+			self.occupationBatch = OccupationBatch()
+		if self.batchFramePropagation or self.partState is not None:
+			self.partsToPosition = []
+		if self.partState is not None:
+			numRowsAtStartOfDay = self.partState.numRows
+			self.partState.calculateSenescence()
+		if self.phaseSynchronousDay:
+			self.nextDayByPhase()
+		else:
+			self.firstInternode.nextDay()
+			self.firstRootInternode.nextDay()
+		if self.partState is not None:
+			self.updatePartState(numRowsAtStartOfDay)
+		if self.partsToPosition is not None:
+			self.propagateFrames()
+		if self.occupationBatch is not None:
+			self.occupyBlocks()
 		self.calculateStresses()
 		self.age += 1
 		
+	def nextDayByPhase(self):
+		# The tree goes through the day a phase at a time (see Tree.__init__). The parts that do the day
+		# are the ones the signal would reach, which are the ones on the tree when the day starts. 
+		# In each phase the internodes go first, in the order they were made (so each comes after the one it hangs off),
+		# then what hangs off them, kind by kind (see PHASE_ORDER). Only the parts whose class does something 
+		# in a phase (see TreePart.dayPhases) are asked to do it.
+		if self.phaseSynchronousDayInSignalOrder:
+			parts = list(partsInSignalOrder(self.firstInternode, "signalRecipients"))
+			parts.extend(partsInSignalOrder(self.firstRootInternode, "signalRecipients"))
+			for part in parts:
+				for phase in part.dayPhases:
+					getattr(part, phase)()
+			return
+		parts = []
+		for partClass in PHASE_ORDER:
+			parts.extend(self.partsOfType(partClass))
+			if partClass is not Internode:
+				parts.extend(self.partsOfType(partClass, alive=False))
+		partsForPhase = dict((phase, []) for phase in DAY_PHASES)
+		for part in parts:
+			for phase in part.dayPhases:
+				partsForPhase[phase].append(part)
+		# One leaf cluster's photosynthesis doesn't change any other's, so they can all be done at once
+		# (see leafClusterUptake) unless the tree already did them this morning (see batchLeafUptake).
+		if not self.batchLeafUptake:
+			leafClusters = [part for part in partsForPhase["nextDay_Uptake"] if isinstance(part, LeafCluster)]
+			if leafClusters:
+				leafClusterUptake(self.world, leafClusters)
+				partsForPhase["nextDay_Uptake"] = [part for part in partsForPhase["nextDay_Uptake"] if not isinstance(part, LeafCluster)]
+		for phase in DAY_PHASES:
+			for part in partsForPhase[phase]:
+				getattr(part, phase)()
+		
+	def partsOfType(self, partClass, alive=True):
+		# All the live (or dead) parts of one kind on the tree, in the order they were made, 
+		# without going around the tree to find them. Internodes are always live (see Tree.__init__).
+		if alive:
+			return self.liveParts[partClass.typeCode]
+		return self.deadParts[partClass.typeCode]
+	
+	def partDied(self, part):
+		self.liveParts[part.typeCode].remove(part)
+		self.deadParts[part.typeCode].add(part)
+		
+	def partWentAway(self, part):
+		# a meristem that turned into an internode or flower cluster, or a flower cluster that turned into a fruit cluster
+		if part.alive:
+			self.liveParts[part.typeCode].remove(part)
+		else:
+			self.deadParts[part.typeCode].remove(part)
+			
+	def rootUptake(self):
+		# All the root internodes take up water and minerals in one batch (see BATCH_ROOT_UPTAKE).
+		# They take their turns in the order they were made.
+		rootInternodes = [internode for internode in self.partsOfType(Internode) if internode.root]
+		endLocations = [internode.endLocation for internode in rootInternodes]
+		waterTaken = self.world.extractWaterOrMinerals("water", endLocations, ROOT_WATER_EXTRACTION_RADIUS, ROOT_WATER_EXTRACTION_EFFICIENCY)
+		mineralsTaken = self.world.extractWaterOrMinerals("minerals", endLocations, ROOT_MINERAL_EXTRACTION_RADIUS, ROOT_MINERAL_EXTRACTION_EFFICIENCY)
+		for internode, water, minerals in zip(rootInternodes, waterTaken.tolist(), mineralsTaken.tolist()):
+			internode.water += water
+			internode.minerals += minerals
+		
+	def transportResources(self):
+		# Biomass, water and minerals move through the whole tree at once (see Tree.__init__).
+		# The tree is a graph with an edge from each internode to every part its distribution plans name,
+		# weighted the way the internode would split its extra among them in nextDay_Distribution:
+		# the first gets the spread of it, the next the spread of what is left, and so on.
+		internodes = list(self.partsOfType(Internode))
+		parts = list(internodes)
+		partIndexes = dict((internode, index) for index, internode in enumerate(internodes))
+		biomassPlans = [BIOMASS_DISTRIBUTION_PLANS[self.prevailingStressCondition, internode.root] for internode in internodes]
+		waterPlans = [(WATER_DISTRIBUTION_PLANS[internode.root], WATER_DISTRIBUTION_SPREAD_PERCENT[internode.root]) for internode in internodes]
+		mineralsPlans = [(MINERALS_DISTRIBUTION_PLANS[internode.root], MINERALS_DISTRIBUTION_SPREAD_PERCENT[internode.root]) for internode in internodes]
+		biomassEdges = self.transportEdges(internodes, biomassPlans, parts, partIndexes)
+		waterEdges = self.transportEdges(internodes, waterPlans, parts, partIndexes)
+		mineralsEdges = self.transportEdges(internodes, mineralsPlans, parts, partIndexes)
+		# internodes keep what they need for themselves and give away only the rest; all the water and minerals are extra
+		biomassKept = np.array([OPTIMAL_INTERNODE_BIOMASS[internode.root] + BIOMASS_USED_BY_INTERNODE_PER_DAY[internode.root] 
+			for internode in internodes], dtype=float)
+		nothingKept = np.zeros(len(internodes))
+		for name, edges, kept in [("biomass", biomassEdges, biomassKept), ("water", waterEdges, nothingKept), 
+				("minerals", mineralsEdges, nothingKept)]:
+			amountsBefore = [getattr(part, name) for part in parts]
+			amounts = np.array(amountsBefore, dtype=float)
+			room = np.array([getattr(part, name + "INeed")() for part in parts], dtype=float)
+			sources, targets, weights = edges
+			transportAlongGraph(amounts, room, kept, sources, targets, weights, self.transportRoundsPerDay)
+			# parts that nothing went to or from keep their amounts just as they were
+			for part, amountBefore, amount in zip(parts, amountsBefore, amounts.tolist()):
+				if amount != amountBefore:
+					setattr(part, name, amount)
+		
+	def transportEdges(self, internodes, plansAndSpreads, parts, partIndexes):
+		# Makes the edges for one thing being moved, adding parts the graph doesn't have yet to parts and partIndexes.
+		sources = []
+		targets = []
+		weights = []
+		for source, (internode, (plan, spread)) in enumerate(zip(internodes, plansAndSpreads)):
+			weight = spread
+			for distributees in plan:
+				for part in distributees(internode):
+					if part:
+						if part not in partIndexes:
+							partIndexes[part] = len(parts)
+							parts.append(part)
+						sources.append(source)
+						targets.append(partIndexes[part])
+						weights.append(weight)
+						weight *= 1.0 - spread
+		return np.array(sources, dtype=int), np.array(targets, dtype=int), np.array(weights, dtype=float)
+		
+	def updatePartState(self, numRows):
+		# Consumption, growth and aging for all the parts that got the day signal today (see ARRAY_PART_STATE),
+		# which are the ones that were already on the tree when the day started, and the deaths that go with them.
+		# Only the fruit clusters the flower clusters turn into (which are new parts) are made one at a time.
+		partState = self.partState
+		dyingInternodes, deadRows = partState.consume(numRows)
+		for row in deadRows.tolist() + partState.passOnDeath(dyingInternodes).tolist():
+			self.partDied(partState.parts[row])
+		makingFruit = partState.grow(numRows)
+		partState.attached[makingFruit] = False
+		for row in makingFruit:
+			partState.parts[row].buildFruit()
+		partState.growOlder(numRows)
+		
+	def propagateFrames(self):
+		# All the parts that got the next-day signal today work out where they are in one pass
+		# (see BATCH_FRAME_PROPAGATION), then claim their blocks in the order the signal reached them.
+		# Parts are placed a generation at a time: first the parts that don't hang off anything
+		# (the first stem and root internodes), then everything attached to them, and so on.
+		# Each generation is placed with a few array operations; only the internodes that seek 
+		# better locations for their ends have to be handled one at a time.
+		parts = self.partsToPosition
+		self.partsToPosition = None
+		numParts = len(parts)
+		attachments = [part.attachment() for part in parts]
+		indexForPart = {}
+		parentIndexes = np.zeros(numParts, dtype=np.int64)
+		generations = []
+		orientations = np.empty((numParts, 3, 3))
+		locations = np.empty((numParts, 3))
+		endLocations = np.zeros((numParts, 3))
+		for index, part in enumerate(parts):
+			indexForPart[part] = index
+			if attachments[index] is None:
+				generation = 0
+				orientations[index] = part.matrix.orientation
+				locations[index] = (part.matrix.location.x, part.matrix.location.y, part.matrix.location.z)
+			else:
+				# a part's parent internode always gets the signal (and so is in the list) before the part does
+				parentIndexes[index] = indexForPart[part.parent]
+				generation = generations[parentIndexes[index]] + 1
+			generations.append(generation)
+		generations = np.array(generations, dtype=np.int64)
+		internodes = np.array([isinstance(part, Internode) for part in parts], dtype=bool)
+		for generation in range(int(generations.max()) + 1 if numParts else 0):
+			inGeneration = generations == generation
+			if generation > 0:
+				attached = np.nonzero(inGeneration)[0]
+				movesBefore, xRotations, yRotations, movesAfter = zip(*[attachments[index] for index in attached.tolist()])
+				parents = parentIndexes[attached]
+				orientations[attached], locations[attached] = attachFrames(orientations[parents], endLocations[parents], 
+					movesBefore, xRotations, yRotations, movesAfter)
+			internodesInGeneration = np.nonzero(inGeneration & internodes)[0]
+			if len(internodesInGeneration):
+				lengths = np.array([parts[index].length for index in internodesInGeneration.tolist()])
+				aboveGround = np.array([not parts[index].root for index in internodesInGeneration.tolist()])
+				ends = locations[internodesInGeneration] + lengths[:, np.newaxis] * orientations[internodesInGeneration, :, 0]
+				ends = self.world.boundVoxels(ends, aboveGround)
+				for index, end in zip(internodesInGeneration.tolist(), ends.tolist()):
+					internode = parts[index]
+					internode.endLocation = Point3D(end[0], end[1], end[2])
+					internode.seekBetterEndLocation()
+					endLocations[index] = (internode.endLocation.x, internode.endLocation.y, internode.endLocation.z)
+		for index, part in enumerate(parts):
+			if attachments[index] is not None:
+				x, y, z = locations[index].tolist()
+				part.matrix = Matrix3D(x, y, z)
+				part.matrix.orientation = orientations[index].copy()
+			part.claimBlocks()
+		
+	def occupyBlocks(self):
+		# All the parts that asked for blocks today get them (see BATCH_BLOCK_OCCUPATION), 
+		# in the same order the next-day signal reached them.
+		batch = self.occupationBatch
+		self.occupationBatch = None
+		voxels, partIndexes = batch.voxelize(self.world, [self.trunkMatrix.location, self.rootMatrix.location])
+		firstRows = np.searchsorted(partIndexes, np.arange(len(batch.parts) + 1)).tolist()
+		voxels = voxels.tolist()
+		for partIndex, treePart in enumerate(batch.parts):
+			if batch.partsChanged[partIndex]:
+				treePart.blocks = [Point3D(x, y, z) for x, y, z in voxels[firstRows[partIndex]:firstRows[partIndex+1]]]
+				treePart.reclaimBlocks()
+				treePart.releaseBlocksNoLongerUsed()
+			else:
+				treePart.reclaimBlocks()
+		
 	def calculateStresses(self):
-		self.leafClusterCount, self.totalLowSunAndShadeStress, self.totalLowWaterStress, \
-			self.totalLowMineralStress = self.firstInternode.sumUpStresses()
+		if self.checkStressTotals:
+			self.verifyStressTotals()
 		highestStress = max(self.totalLowSunAndShadeStress, self.totalLowWaterStress, self.totalLowMineralStress)
-		self.averageHighestStressPerLeaf = highestStress / self.leafClusterCount
+		self.averageHighestStressPerLeaf = highestStress / self.numLeafClusters()
 		if self.averageHighestStressPerLeaf < MIN_STRESS_TO_TRIGGER_BIOMASS_REDISTRIBUTION:
 			if self.reproductivePhaseHasStarted:
 				self.prevailingStressCondition = "reproduction"
@@ -1068,6 +2000,20 @@ class Tree():
 		elif highestStress == self.totalLowMineralStress:
 			self.prevailingStressCondition = "minerals"
 		
+	def numLeafClusters(self):
+		# dead leaf clusters stay on the tree, and they keep their last stresses
+		return len(self.partsOfType(LeafCluster)) + len(self.partsOfType(LeafCluster, alive=False))
+		
+	def verifyStressTotals(self):
+		# Adds up the stresses of all the leaf clusters the slow way (see Tree.__init__),
+		# and says so if the running totals don't match (allowing for a little rounding).
+		walkedTotals = self.firstInternode.sumUpStresses()
+		runningTotals = (self.numLeafClusters(), self.totalLowSunAndShadeStress, self.totalLowWaterStress, self.totalLowMineralStress)
+		names = ("leaf cluster count", "low sun and shade stress", "low water stress", "low mineral stress")
+		for name, walkedTotal, runningTotal in zip(names, walkedTotals, runningTotals):
+			if abs(walkedTotal - runningTotal) > 1e-6 * max(1, walkedTotals[0]):
+				print 'day %s: running total of %s is %s, but the leaf clusters add up to %s' % (self.age, name, runningTotal, walkedTotal)
+		
 	def describe(self, outputFile):
 		outputFile.write('%s: \n' % self.__class__.__name__)
 		fields = self.__dict__
@@ -1075,6 +2021,8 @@ class Tree():
 		fieldKeysSorted.extend(fields.keys())
 		fieldKeysSorted.sort()
 		for key in fieldKeysSorted:
+			if isinstance(fields[key], TreePart):
+				continue # the parts describe themselves below
 			valueAsString = str(fields[key])
 			if not valueAsString.find("instance") >= 0:
 				outputFile.write('    ' + key + ": " + valueAsString + "\n")
@@ -1083,16 +2031,16 @@ class Tree():
 		self.firstRootInternode.describe(outputFile)
 		
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
-def growTree(outputFolder, iteration):
+def growTree(world, outputFolder, iteration):
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 	drawGraphs = False
 	if drawGraphs:
 		print 'writing distribution graphs...'
-		drawSunDistribution(outputFolder)
-		if PATCHY_WATER:
-			drawWaterDistribution(outputFolder)
-		if PATCHY_MINERALS:
-			drawMineralsDistribution(outputFolder)
+		drawSunDistribution(world, outputFolder)
+		if world.patchyWater:
+			drawWaterDistribution(world, outputFolder)
+		if world.patchyMinerals:
+			drawMineralsDistribution(world, outputFolder)
 			
 	describeTrees = True
 	if describeTrees:
@@ -1110,8 +2058,8 @@ def growTree(outputFolder, iteration):
 			else:
 				xLocation = 10 + random.randrange(80)
 				yLocation = 10 + random.randrange(80)
-			zLocation = GROUND_LEVEL+1
-			newTree = Tree(xLocation, yLocation, zLocation)
+			zLocation = world.groundLevel+1
+			newTree = Tree(world, xLocation, yLocation, zLocation)
 			trees.append(newTree)
 			
 		if describeTrees:
@@ -1133,7 +2081,7 @@ def growTree(outputFolder, iteration):
 						tree.describe(outputFile)
 				day += 1
 			print '  drawing space on day %s...' % (day-1)
- 			drawSpace(day-1, outputFolder, iteration+1, drawTrees=True, 
+ 			drawSpace(world, day-1, outputFolder, iteration+1, drawTrees=True, 
 					drawSun=False, drawSurface=False, drawWater=False, drawMinerals=True)
 	finally:
 		if describeTrees:
@@ -1146,8 +2094,10 @@ def main():
 		outputFolder = setUpOutputFolder("/Users/cfkurtz/Documents/personal/terasology/generated images/")
 		#outputFolder = "/Users/cfkurtz/Documents/personal/terasology/generated images/batch/"
 		print 'writing files to:', outputFolder
-		space.clear()
-		growTree(outputFolder, i)
+		world = World()
+		print 'generating sun coverage, water distribution and mineral deposits...'
+		world.generateResourceMaps()
+		growTree(world, outputFolder, i)
 	
 if __name__ == "__main__":
 	main()
@@ -17,6 +17,7 @@
 # -----------------------------------------------------------------------------------------------------------------
 
 import os, math
+from collections import OrderedDict
 import numpy as np
 from math import sqrt, atan, sin, cos, pi
 
@@ -28,7 +29,12 @@ from math import sqrt, atan, sin, cos, pi
 # to calculate movement in 3D space using vectors. But it does work.
 # -------------------------------------------------------------------------------------------
 
-class Point3D:
+# Points are never changed once they are made (matrices make new ones as they move), so each point
+# can keep its hash once it has been asked for it. Points and matrices use __slots__ because there are
+# so many of them (every block a tree part occupies is a point).
+class Point3D(object):
+	__slots__ = ("x", "y", "z", "hashValue")
+	
 	def __init__(self, x=0.0, y=0.0, z=0.0):
 		self.x = x
 		self.y = y
@@ -41,7 +47,11 @@ class Point3D:
 		return self.x == other.x and self.y == other.y and self.z == other.z
 	
 	def __hash__(self):
-		return hash((self.x, self.y, self.z))
+		try:
+			return self.hashValue
+		except AttributeError:
+			self.hashValue = hash((self.x, self.y, self.z))
+			return self.hashValue
 	
 	def rounded(self):
 		return Point3D(int(round(self.x)), int(round(self.y)), int(round(self.z)))
@@ -49,129 +59,124 @@ class Point3D:
 	def makeCopy(self):
 		return Point3D(self.x, self.y, self.z)
 	
-class Matrix3D:
+# The orientation part of the matrix is kept as a 3x3 array, with rows a, b and c and columns 0, 1 and 2
+# (so a0 is the top left). Column 0 is the direction of movement. Each rotation multiplies the orientation
+# by a rotation matrix for the axis and angle, and since the same few angles come up over and over 
+# (90, 180, branch angles, whole-number sways), those are kept in rotationMatrices once they are worked out.
+
+MAX_CACHED_ROTATIONS = 10000
+rotationMatrices = {} # (axis, angle in degrees): 3x3 array
+
+def rotationMatrix(axis, angle_degrees):
+	key = (axis, angle_degrees)
+	rotation = rotationMatrices.get(key)
+	if rotation is None:
+		angle_radians = 2.0 * pi * angle_degrees / 360.0
+		cosAngle = cos(angle_radians)
+		sinAngle = sin(angle_radians)
+		if axis == "x":
+			rotation = np.array([[1.0, 0.0, 0.0], [0.0, cosAngle, sinAngle], [0.0, -sinAngle, cosAngle]])
+		elif axis == "y":
+			rotation = np.array([[cosAngle, 0.0, -sinAngle], [0.0, 1.0, 0.0], [sinAngle, 0.0, cosAngle]])
+		else:
+			rotation = np.array([[cosAngle, sinAngle, 0.0], [-sinAngle, cosAngle, 0.0], [0.0, 0.0, 1.0]])
+		if len(rotationMatrices) >= MAX_CACHED_ROTATIONS:
+			rotationMatrices.clear()
+		rotationMatrices[key] = rotation
+	return rotation
+
+def orientationProperty(row, column):
+	# lets the old a0 ... c2 fields be read and set as before
+	def getValue(self):
+		return self.orientation.item(row, column)
+	def setValue(self, value):
+		self.orientation[row, column] = value
+	return property(getValue, setValue)
+
+# This places many matrices at once, each hanging off the end of a parent: it moves along the parent's direction
+# from the parent's end location, turns around x and then y, and moves again in the new direction.
+# It does the same arithmetic in the same order as makeCopy, setLocation, move, rotateX, rotateY and move
+# would on each matrix, so the results are the same. Orientations are given and returned as stacked 3x3 arrays,
+# locations as (x, y, z) rows.
+def attachFrames(parentOrientations, parentEndLocations, movesBefore, xRotations, yRotations, movesAfter):
+	startLocations = parentEndLocations + np.asarray(movesBefore, dtype=np.float64)[:, np.newaxis] * parentOrientations[:, :, 0]
+	xTurns = np.array([rotationMatrix("x", angle) for angle in xRotations])
+	yTurns = np.array([rotationMatrix("y", angle) for angle in yRotations])
+	orientations = np.matmul(np.matmul(parentOrientations, xTurns), yTurns)
+	locations = startLocations + np.asarray(movesAfter, dtype=np.float64)[:, np.newaxis] * orientations[:, :, 0]
+	return orientations, locations
+
+class Matrix3D(object):
+	__slots__ = ("orientation", "location")
+	
 	def __init__(self, x, y, z):
-		self.a0 = 0.0
-		self.a1 = 0.0
-		self.a2 = 0.0
-		self.b0 = 0.0
-		self.b1 = 0.0
-		self.b2 = 0.0
-		self.c0 = 0.0
-		self.c1 = 0.0
-		self.c2 = 0.0
+		self.orientation = np.zeros((3, 3))
 		self.location = Point3D(x, y, z)
 		
+	a0 = orientationProperty(0, 0)
+	a1 = orientationProperty(0, 1)
+	a2 = orientationProperty(0, 2)
+	b0 = orientationProperty(1, 0)
+	b1 = orientationProperty(1, 1)
+	b2 = orientationProperty(1, 2)
+	c0 = orientationProperty(2, 0)
+	c1 = orientationProperty(2, 1)
+	c2 = orientationProperty(2, 2)
+		
 	def __repr__(self):
-		return "Matrix3D: (%f %f %f) (%f %f %f) (%f %f %f)" %(self.a0, self.a1, self.a2, self.b0, self.b1, self.b2, self.c0, self.c1, self.c2)
+		return "Matrix3D: (%f %f %f) (%f %f %f) (%f %f %f)" % tuple(self.orientation.ravel().tolist())
 	
 	def initializeAsUnitMatrix(self):
-		self.a0 = 1.0
-		self.a1 = 0.0
-		self.a2 = 0.0
-		self.b0 = 0.0
-		self.b1 = 1.0
-		self.b2 = 0.0
-		self.c0 = 0.0
-		self.c1 = 0.0
-		self.c2 = 1.0
-		self.location.x = 0.0
-		self.location.y = 0.0
-		self.location.z = 0.0
+		self.orientation = np.identity(3)
+		self.location = Point3D(0.0, 0.0, 0.0)
 		
 	def setLocation(self, x, y, z):
-		self.location.x = x
-		self.location.y = y
-		self.location.z = z
+		self.location = Point3D(x, y, z)
 	
 	def makeCopy(self):
-		result = Matrix3D(self.location.x, self.location.y, self.location.z)
-		result.a0 = self.a0
-		result.a1 = self.a1
-		result.a2 = self.a2
-		result.b0 = self.b0
-		result.b1 = self.b1
-		result.b2 = self.b2
-		result.c0 = self.c0
-		result.c1 = self.c1
-		result.c2 = self.c2
+		result = Matrix3D.__new__(Matrix3D)
+		result.orientation = self.orientation.copy()
+		result.location = Point3D(self.location.x, self.location.y, self.location.z)
 		return result
 	
+	def asTuple(self):
+		# everything about where the matrix is and which way it points, for comparing
+		return tuple(self.orientation.ravel().tolist()) + (self.location.x, self.location.y, self.location.z)
+	
 	def move(self, distance):
 		# movement is along x axis (d, 0, 0, 1)
-		self.location.x = self.location.x + distance * self.a0
-		self.location.y = self.location.y + distance * self.b0
-		self.location.z = self.location.z + distance * self.c0
+		self.location = self.calculateMove(distance)
 	
 	def calculateMove(self, distance):
-		x = self.location.x + distance * self.a0
-		y = self.location.y + distance * self.b0
-		z = self.location.z + distance * self.c0
+		orientation = self.orientation
+		x = self.location.x + distance * orientation.item(0, 0)
+		y = self.location.y + distance * orientation.item(1, 0)
+		z = self.location.z + distance * orientation.item(2, 0)
 		return Point3D(x,y,z)
 	
 	def convertAngleFromDegreesToRadians(self, angle_degrees):
 		return 2.0 * pi * angle_degrees / 360.0
 	
 	def rotateX(self, angle_degrees):
-		angle_radians = self.convertAngleFromDegreesToRadians(angle_degrees)
-		cosAngle = cos(angle_radians)
-		sinAngle = sin(angle_radians)
-		self.a0 = self.a0
-		temp1 = (self.a1 * cosAngle) - (self.a2 * sinAngle)
-		self.a2 = (self.a1 * sinAngle) + (self.a2 * cosAngle)
-		self.a1 = temp1
-		self.b0 = self.b0
-		temp1 = (self.b1 * cosAngle) - (self.b2 * sinAngle)
-		self.b2 = (self.b1 * sinAngle) + (self.b2 * cosAngle)
-		self.b1 = temp1
-		self.c0 = self.c0
-		temp1 = (self.c1 * cosAngle) - (self.c2 * sinAngle)
-		self.c2 = (self.c1 * sinAngle) + (self.c2 * cosAngle)
-		self.c1 = temp1
+		self.orientation = np.dot(self.orientation, rotationMatrix("x", angle_degrees))
 	
 	def rotateY(self, angle_degrees):
-		angle_radians = self.convertAngleFromDegreesToRadians(angle_degrees)
-		cosAngle = cos(angle_radians)
-		sinAngle = sin(angle_radians)
-		temp0 = (self.a0 * cosAngle) + (self.a2 * sinAngle)
-		self.a1 = self.a1
-		self.a2 = (self.a2 * cosAngle) - (self.a0 * sinAngle)
-		self.a0 = temp0
-		temp0 = (self.b0 * cosAngle) + (self.b2 * sinAngle)
-		self.b1 = self.b1
-		self.b2 = (self.b2 * cosAngle) - (self.b0 * sinAngle)
-		self.b0 = temp0
-		temp0 = (self.c0 * cosAngle) + (self.c2 * sinAngle)
-		self.c1 = self.c1
-		self.c2 = (self.c2 * cosAngle) - (self.c0 * sinAngle)
-		self.c0 = temp0
+		self.orientation = np.dot(self.orientation, rotationMatrix("y", angle_degrees))
 	
 	def rotateZ(self, angle_degrees):
-		angle_radians = self.convertAngleFromDegreesToRadians(angle_degrees)
-		cosAngle = cos(angle_radians)
-		sinAngle = sin(angle_radians)
-		temp0 = (self.a0 * cosAngle) - (self.a1 * sinAngle)
-		self.a1 = (self.a0 * sinAngle) + (self.a1 * cosAngle)
-		self.a2 = self.a2
-		self.a0 = temp0
-		temp0 = (self.b0 * cosAngle) - (self.b1 * sinAngle)
-		self.b1 = (self.b0 * sinAngle) + (self.b1 * cosAngle)
-		self.b2 = self.b2
-		self.b0 = temp0
-		temp0 = (self.c0 * cosAngle) - (self.c1 * sinAngle)
-		self.c1 = (self.c0 * sinAngle) + (self.c1 * cosAngle)
-		self.c2 = self.c2
-		self.c0 = temp0
+		self.orientation = np.dot(self.orientation, rotationMatrix("z", angle_degrees))
 
-# This method brute-forces a line through voxels.
-# To interpolate between voxels, two locations are added:
-# the voxel with all values truncated, and the voxel with all values rounded.
-# This makes it nearly impossible to get perfectly one-width lines, but
-# it is necessary when lines are to be set at arbitrary angles.
-# Because that was slow, and to get more variety two more methods were added.
+# This method draws a line through voxels.
+# The "solid" method walks the line from voxel to voxel (see voxelsCrossedByLine),
+# so every block the line passes through comes back exactly once, whatever the length.
+# (It used to brute-force this by adding the truncated and rounded voxel for many points along
+# the line, which was slow and made nearly every block come back several times.)
+# To get more variety two more methods were added, which do use the number of points given.
 # Presumably you could have even more methods to create a wider variety
 # of ways lines are drawn to create internodes.
 def locationsBetweenTwoPoints(firstLocation, secondLocation, length, lineMethod="solid"):
+	if lineMethod == "solid":
+		return [Point3D(x, y, z) for x, y, z in voxelsCrossedByLine(firstLocation, secondLocation).tolist()]
 	locations = []
 	intLength = int(round(length))
 	for i in range(intLength):
@@ -194,21 +199,94 @@ def locationsBetweenTwoPoints(firstLocation, secondLocation, length, lineMethod=
 			locations.append(Point3D(x,y,z))
 		elif lineMethod == "sparse":
 			locations.append(Point3D(x,y,z))
-		elif lineMethod == "solid":
-			floorPoint = Point3D(math.floor(x), math.floor(y), math.floor(z))
-			ceilingPoint = Point3D(math.ceil(x), math.ceil(y), math.ceil(z))
-			locations.append(floorPoint)
-			locations.append(ceilingPoint)
 		else:
 			raise Exception.create("Unrecognized internode line drawing method: %s" % lineMethod)
 	locations.append(secondLocation) 
 	return locations
 
-# This method brute-forces a series of lines around a central spine to create either a 3D shape
-# for a leaf/flower/fruit cluster, or a cylinder (hollow or solid) for a stem.
-# Sadly, this method seems to bog things down horribly (by a factor of ten or more) 
-# in terms of performance when stems are thick.
-# Probably there are better solutions ...
+# This walks a line through the grid of blocks, one block at a time, in the manner of Amanatides and Woo
+# ("A fast voxel traversal algorithm for ray tracing"). Each block is centered on its integer location,
+# so the walk starts in the block the first location rounds to and ends in the block the second location
+# rounds to. At each step it moves into whichever neighboring block the line enters next.
+# The result is an array of (x, y, z) integer rows, one for each block the line passes through.
+def voxelsCrossedByLine(firstLocation, secondLocation):
+	# shifting by half a block puts block boundaries on whole numbers
+	start = (firstLocation.x + 0.5, firstLocation.y + 0.5, firstLocation.z + 0.5)
+	end = (secondLocation.x + 0.5, secondLocation.y + 0.5, secondLocation.z + 0.5)
+	voxel = [int(math.floor(start[0])), int(math.floor(start[1])), int(math.floor(start[2]))]
+	lastVoxel = [int(math.floor(end[0])), int(math.floor(end[1])), int(math.floor(end[2]))]
+	steps = [0, 0, 0]
+	nextCrossing = [float("inf")] * 3 # how far along the line (0 to 1) it crosses into the next block, on each axis
+	crossingInterval = [float("inf")] * 3 # how far along the line it goes to get across one whole block, on each axis
+	for axis in range(3):
+		distance = end[axis] - start[axis]
+		if lastVoxel[axis] > voxel[axis]:
+			steps[axis] = 1
+			nextCrossing[axis] = (voxel[axis] + 1 - start[axis]) / distance
+			crossingInterval[axis] = 1.0 / distance
+		elif lastVoxel[axis] < voxel[axis]:
+			steps[axis] = -1
+			nextCrossing[axis] = (voxel[axis] - start[axis]) / distance
+			crossingInterval[axis] = -1.0 / distance
+	numSteps = abs(lastVoxel[0] - voxel[0]) + abs(lastVoxel[1] - voxel[1]) + abs(lastVoxel[2] - voxel[2])
+	voxels = np.empty((numSteps + 1, 3), dtype=np.int32)
+	voxels[0] = voxel
+	for i in range(1, numSteps + 1):
+		# only axes that haven't reached the last block yet can be stepped along, so the walk always ends there
+		axis = -1
+		for eachAxis in range(3):
+			if voxel[eachAxis] != lastVoxel[eachAxis] and (axis < 0 or nextCrossing[eachAxis] < nextCrossing[axis]):
+				axis = eachAxis
+		voxel[axis] += steps[axis]
+		nextCrossing[axis] += crossingInterval[axis]
+		voxels[i] = voxel
+	return voxels
+
+# This does the same walk as voxelsCrossedByLine, but for many lines at once, taking all the lines
+# one step further each time around. Lines that have already reached their last blocks drop out.
+# The result is an array of (x, y, z) integer rows, with the blocks for each line together (in order),
+# and a parallel array saying which line (by index into starts and ends) each block came from.
+def voxelsCrossedByLines(starts, ends):
+	starts = np.asarray(starts, dtype=np.float64) + 0.5
+	ends = np.asarray(ends, dtype=np.float64) + 0.5
+	numLines = len(starts)
+	voxels = np.floor(starts).astype(np.int64)
+	lastVoxels = np.floor(ends).astype(np.int64)
+	steps = np.sign(lastVoxels - voxels)
+	distances = ends - starts
+	with np.errstate(divide="ignore", invalid="ignore"):
+		nextCrossings = np.where(steps > 0, (voxels + 1 - starts) / distances, (voxels - starts) / distances)
+		crossingIntervals = steps / distances
+	nextCrossings[steps == 0] = np.inf
+	numSteps = np.abs(lastVoxels - voxels).sum(axis=1)
+	firstRows = np.zeros(numLines, dtype=np.int64)
+	if numLines:
+		firstRows[1:] = np.cumsum(numSteps + 1)[:-1]
+	result = np.empty((int((numSteps + 1).sum()), 3), dtype=np.int32)
+	lineForEachVoxel = np.repeat(np.arange(numLines), numSteps + 1)
+	result[firstRows] = voxels
+	for i in range(1, int(numSteps.max()) + 1 if numLines else 1):
+		lines = np.nonzero(numSteps >= i)[0]
+		# as in voxelsCrossedByLine, only axes that haven't reached the last block can be stepped along
+		crossings = np.where(voxels[lines] != lastVoxels[lines], nextCrossings[lines], np.inf)
+		axes = np.argmin(crossings, axis=1)
+		voxels[lines, axes] += steps[lines, axes]
+		nextCrossings[lines, axes] += crossingIntervals[lines, axes]
+		result[firstRows[lines] + i] = voxels[lines]
+	return result, lineForEachVoxel
+
+# These round locations to blocks (the same way Point3D.rounded does, with halves going away from zero),
+# giving an array of (x, y, z) integer rows.
+def voxelsForLocations(locations):
+	return voxelsForCoordinates([(location.x, location.y, location.z) for location in locations])
+
+def voxelsForCoordinates(coordinates):
+	coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+	return (np.sign(coordinates) * np.floor(np.abs(coordinates) + 0.5)).astype(np.int32)
+
+# This method brute-forces a series of lines around a central spine to create a 3D shape
+# for a leaf/flower/fruit cluster. (It used to make the cylinders for thick stems as well,
+# but that bogged things down horribly; those now come from voxelsForCylinder.)
 def locationsForShapeAroundSpine(spine, pattern, numSides, sizeProportion, hollow, matrix):
 	wings = []
 	lengthIndex = 0
@@ -232,6 +310,100 @@ def locationsForShapeAroundSpine(spine, pattern, numSides, sizeProportion, hollo
 		lengthIndex += 1
 	return wings
 
+# This makes the blocks for a thick stem: a cylinder of the given radius around the line between the two points,
+# either solid or (if hollow) just the outer shell, one block thick. Every block whose center lies inside the
+# cylinder (or shell) is returned, once each. It works by testing all the blocks in the box around the cylinder
+# at once, so it doesn't matter how thick the stem is. The line itself is not included.
+# The result is an array of (x, y, z) integer rows.
+def voxelsForCylinder(firstLocation, secondLocation, radius, hollow):
+	start = np.array([firstLocation.x, firstLocation.y, firstLocation.z], dtype=np.float64)
+	end = np.array([secondLocation.x, secondLocation.y, secondLocation.z], dtype=np.float64)
+	axis = end - start
+	length = sqrt(np.dot(axis, axis))
+	if length == 0 or radius <= 0:
+		return np.empty((0, 3), dtype=np.int32)
+	axis /= length
+	lowCorner = np.floor(np.minimum(start, end) - radius).astype(np.int64)
+	highCorner = np.ceil(np.maximum(start, end) + radius).astype(np.int64)
+	xs, ys, zs = np.mgrid[lowCorner[0]:highCorner[0]+1, lowCorner[1]:highCorner[1]+1, lowCorner[2]:highCorner[2]+1]
+	blocks = np.column_stack((xs.ravel(), ys.ravel(), zs.ravel()))
+	fromStart = blocks - start
+	alongAxis = np.dot(fromStart, axis)
+	fromAxis = fromStart - np.outer(alongAxis, axis)
+	distanceFromAxis = np.sqrt(np.einsum('ij,ij->i', fromAxis, fromAxis))
+	inside = (alongAxis >= 0) & (alongAxis <= length) & (distanceFromAxis <= radius + 0.5)
+	if hollow:
+		inside &= distanceFromAxis > radius - 0.5
+	return blocks[inside].astype(np.int32)
+
+# Cluster shapes (leaf, flower and fruit clusters) depend only on the shape parameters, the length
+# of the spine and which way the cluster points. Since the same few shapes come up over and over,
+# this keeps a template of block offsets (from the cluster's start block) for each shape, with the
+# orientation rounded off to the given resolution (in matrix units) so that nearly-identical
+# orientations share a template. Where the cluster starts inside its block matters too (a shape
+# half a block over rounds to different blocks), so that is rounded off to a fraction of a block
+# and kept in the key as well. The least recently used templates are thrown out when there are too many.
+# If maxTemplates is zero, nothing is cached and every shape is worked out exactly where it is.
+class ShapeTemplateCache(object):
+	def __init__(self, maxTemplates, orientationResolution, positionsPerBlock):
+		self.maxTemplates = maxTemplates
+		self.orientationResolution = orientationResolution
+		self.positionsPerBlock = positionsPerBlock
+		self.templates = OrderedDict()
+		self.patternExtents = {} # pattern string: list of ints
+		self.hits = 0
+		self.misses = 0
+		
+	def extentsForPattern(self, pattern):
+		extents = self.patternExtents.get(pattern)
+		if extents is None:
+			extents = [int(character) for character in pattern]
+			self.patternExtents[pattern] = extents
+		return extents
+		
+	def voxelsForShape(self, matrix, length, pattern, numSides, sizeProportion, hollow):
+		# The result is an array of (x, y, z) integer rows.
+		if self.maxTemplates <= 0:
+			spineEndLocation = matrix.calculateMove(length)
+			spine = locationsBetweenTwoPoints(matrix.location, spineEndLocation, length)
+			wings = locationsForShapeAroundSpine(spine, pattern, numSides, sizeProportion, hollow, matrix)
+			return voxelsForLocations(spine + wings)
+		# only the side extents that come out of the size proportion matter, not the proportion itself
+		extents = tuple([max(0, min(extent, int(round(sizeProportion * extent)))) for extent in self.extentsForPattern(pattern)])
+		resolution = self.orientationResolution
+		orientation = tuple([int(round(component / resolution)) for component in matrix.orientation.ravel().tolist()])
+		halfBlocksLong = int(round(length * 2))
+		location = matrix.location
+		start = (int(math.floor(location.x)), int(math.floor(location.y)), int(math.floor(location.z)))
+		steps = self.positionsPerBlock
+		position = (min(steps-1, int((location.x - start[0]) * steps)), min(steps-1, int((location.y - start[1]) * steps)), 
+				min(steps-1, int((location.z - start[2]) * steps)))
+		key = (pattern, numSides, extents, hollow, halfBlocksLong, orientation, position)
+		template = self.templates.pop(key, None)
+		if template is None:
+			self.misses += 1
+			template = self.makeTemplate(orientation, position, halfBlocksLong / 2.0, pattern, numSides, sizeProportion, hollow)
+			if len(self.templates) >= self.maxTemplates:
+				self.templates.popitem(last=False)
+		else:
+			self.hits += 1
+		self.templates[key] = template # most recently used go at the end
+		return template + np.array(start, dtype=np.int32)
+	
+	def makeTemplate(self, orientation, position, length, pattern, numSides, sizeProportion, hollow):
+		resolution = self.orientationResolution
+		# the shape starts in the middle of its fraction of the block
+		x, y, z = [(step + 0.5) / self.positionsPerBlock for step in position]
+		matrix = Matrix3D(x, y, z)
+		matrix.orientation = np.array(orientation, dtype=np.float64).reshape(3, 3) * resolution
+		spineEndLocation = matrix.calculateMove(length)
+		spine = locationsBetweenTwoPoints(matrix.location, spineEndLocation, length)
+		wings = locationsForShapeAroundSpine(spine, pattern, numSides, sizeProportion, hollow, matrix)
+		# each block only once, in the order they came up
+		offsets = voxelsForLocations(spine + wings)
+		unused, firstIndexes = np.unique(offsets, axis=0, return_index=True)
+		return offsets[np.sort(firstIndexes)]
+
 # for testing the 3D movement/rotation matrix
 def testGraphics():
 	m = Matrix3D(0.0, 0.0, 0.0)
@@ -16,7 +16,7 @@
 # limitations under the License.
 # -----------------------------------------------------------------------------------------------------------------
 
-import os, math, random
+import os, math, random, bisect, itertools
 import numpy as np
 
 from trees_parameters import *
@@ -50,8 +50,13 @@ greens = cm.get_cmap("YlGn")
 # in many blocks, as defined by the species. Some might be better at extracting water,
 # so what "contains" water for some species might not for others.
 # The same is true for minerals.
+
+# Everything about one world lives in a World object, so several worlds can exist in one process.
+# The sun, water and mineral maps are only generated when something first asks for them,
+# so tools that only need the parameters or the 3D classes don't pay for them.
 # -------------------------------------------------------------------------------------------
 
+# These settings are the defaults for new worlds.
 SIZE_OF_SPACE_XY = 100
 SIZE_OF_SPACE_Z = 300
 GROUND_LEVEL = 100
@@ -76,64 +81,24 @@ DRAW_FRUIT_CLUSTERS = True
 # "biomass", "water", "minerals", "photosynthate", "parts"
 COLOR_MAP = "minerals"
 
-space = {}
+# "dense" keeps one big grid the size of the space box; "chunked" allocates small grids only
+# where blocks are occupied, so memory follows the number of blocks used, not the size of the world.
+SPACE_STORAGE = "dense"
+SPACE_CHUNK_SIZE = 16
 
-print 'generating sun coverage...'
+# When this is on, locations are not bounded in x or y (only at the top and bottom of the world),
+# and the space must be chunked. The sun, water and mineral maps still only cover the SIZE_OF_SPACE_XY square;
+# off them there is no sun, water or minerals.
+INFINITE_XY = False
 
-sun = {}
-highestSun = 0
-for i in range(SIZE_OF_SPACE_XY):
-	for j in range(SIZE_OF_SPACE_XY):
-		if PATCHY_SUN:
-			sun[(i,j)] = abs(math.sin(1.0*i/10) + math.cos(1.0*j/10))
-		else:
-			sun[(i,j)] = 1.0
-		if sun[(i,j)] > highestSun:
-			highestSun = sun[(i,j)]
-		
-# normalize sun map
-for i in range(SIZE_OF_SPACE_XY):
-	for j in range(SIZE_OF_SPACE_XY):
-		sun[(i,j)] = sun[(i,j)] / highestSun
+# Leaf, flower and fruit cluster shapes are looked up in a cache of templates instead of being worked out
+# from scratch. Orientations within the resolution (in matrix units, where 1 is the whole turn from one axis
+# to the next) share a template, and so do starting locations within the same fraction of a block,
+# so shapes can be off by a block here and there. Set the size to 0 to draw every shape exactly.
+CLUSTER_SHAPE_CACHE_SIZE = 1000
+CLUSTER_SHAPE_ORIENTATION_RESOLUTION = 0.05
+CLUSTER_SHAPE_POSITIONS_PER_BLOCK = 2
 
-print 'generating water distribution...'
-		
-water = {}
-if PATCHY_WATER:
-	for i in range(NUM_WATER_PATCHES):
-		i = random.randrange(SIZE_OF_SPACE_XY)
-		j = random.randrange(SIZE_OF_SPACE_XY)
-		k = random.randrange(GROUND_LEVEL+1)
-		# CFK FIX - could go out of range
-		for x in range(i-WATER_PATCH_RADIUS, i+WATER_PATCH_RADIUS):
-			for y in range(j-WATER_PATCH_RADIUS, j+WATER_PATCH_RADIUS):
-				for z in range(k-WATER_PATCH_RADIUS, k+WATER_PATCH_RADIUS):
-					water[(x, y, z)] = random.random() * 2.0
-else:
-	for i in range(SIZE_OF_SPACE_XY):
-		for j in range(SIZE_OF_SPACE_XY):
-			for k in range(GROUND_LEVEL+1):
-				water[(i,j,k)] = 1.0
-				
-print 'generating mineral deposits...'
-		
-minerals = {}
-if PATCHY_MINERALS:
-	for i in range(NUM_MINERAL_PATCHES):
-		i = random.randrange(SIZE_OF_SPACE_XY)
-		j = random.randrange(SIZE_OF_SPACE_XY)
-		k = random.randrange(GROUND_LEVEL+1)
-		# CFK FIX - could go out of range
-		for x in range(i-MINERAL_PATCH_RADIUS, i+MINERAL_PATCH_RADIUS):
-			for y in range(j-MINERAL_PATCH_RADIUS, j+MINERAL_PATCH_RADIUS):
-				for z in range(k-MINERAL_PATCH_RADIUS, k+MINERAL_PATCH_RADIUS):
-					minerals[(x, y, z)] = random.random() * 2.0
-else:
-	for i in range(SIZE_OF_SPACE_XY):
-		for j in range(SIZE_OF_SPACE_XY):
-			for k in range(GROUND_LEVEL+1):
-				minerals[(i,j,k)] = 1.0
-				
 # -------------------------------------------------------------------------------------------
 # Managing blocks in 3D space.
 
@@ -145,7 +110,8 @@ else:
 # by having parts go to the end of the stack in the claimLocation() method instead of to the front.
 # By keeping a stack of parts waiting to use any space, instead of allowing only one block to have it,
 # this means that if the block first in the list recalculates and moves, the one waiting below
-# can have the space if they still want it.
+# can have the space if they still want it. The top of each stack lives in the space grid;
+# the parts waiting underneath it live in spaceStacks, which only has entries for contested blocks.
 
 # In this proof-of-concept model there is nothing in the space but empty air to start with. 
 # When there are other things in the space, a species parameter could determine whether 
@@ -154,153 +120,748 @@ else:
 # if the plant stem moves pr is removed
 # -------------------------------------------------------------------------------------------
 
-def claimLocation(location, treePart):
-	# location should always be rounded
-	if not space.has_key(location):
-		space[location] = []
-	if treePart in space[location]:
-		space[location].remove(treePart)
-	space[location].insert(0, treePart)
-	
-def releaseLocation(location, treePart):
-	# location should always be rounded
-	if treePart in space[location]:
-		space[location].remove(treePart)
-	
-def boundXYZ(x, y, z, aboveGround=True):
-	newX = max(0, min(SIZE_OF_SPACE_XY-1, x))
-	newY = max(0, min(SIZE_OF_SPACE_XY-1, y))
-	if aboveGround:
-		newZ = max(GROUND_LEVEL+1, min(SIZE_OF_SPACE_Z-1, z))
-	else:
-		newZ = max(0, min(GROUND_LEVEL + ROOTS_CAN_GROW_THIS_MANY_BLOCKS_ABOVE_GROUND, z))
-	return newX, newY, newZ
-	
-def boundLocation(location, aboveGround):
-	x, y, z = boundXYZ(location.x, location.y, location.z, aboveGround)
-	return Point3D(x, y, z)
-
-def blocksOccupiedAboveLocation(location, treePart):
-	x = int(round(location.x))
-	y = int(round(location.y))
-	z = int(round(location.z))
-	result = 0
-	zAbove = min(SIZE_OF_SPACE_XY-1, z + 1)
-	while zAbove <= SIZE_OF_SPACE_XY-1:
-		locationAbove = Point3D(x, y, zAbove)
-		if space.has_key(locationAbove) and space[locationAbove] and not (space[locationAbove][0] is treePart):
-			result += 1
-		zAbove += 1
-	return result
+class DenseSpace(object):
+	# One grid holding, for each block, the ID of the tree part at the top of its "stack" (zero means empty).
+	def __init__(self, sizeXY, sizeZ):
+		self.owners = np.zeros((sizeXY, sizeXY, sizeZ), dtype=np.int32)
+		
+	def ownerID(self, x, y, z):
+		return self.owners.item(x, y, z)
+	
+	def setOwnerID(self, x, y, z, partID):
+		self.owners[x, y, z] = partID
+		
+	def occupiedBlocks(self):
+		# returned in height order, which makes for better drawing
+		k, i, j = np.nonzero(self.owners.transpose(2, 0, 1))
+		return i, j, k
+	
+	def clear(self):
+		self.owners.fill(0)
+		
+class ChunkedSpace(object):
+	# The same information as the dense space, but split into cubic chunks which are allocated
+	# on the first claim inside them and thrown away again when their last block is released.
+	def __init__(self, chunkSize=SPACE_CHUNK_SIZE):
+		self.chunkSize = chunkSize
+		self.chunks = {}
+		self.chunkCounts = {}
+		
+	def ownerID(self, x, y, z):
+		size = self.chunkSize
+		chunk = self.chunks.get((x // size, y // size, z // size))
+		if chunk is None:
+			return 0
+		return chunk.item(x % size, y % size, z % size)
+	
+	def setOwnerID(self, x, y, z, partID):
+		size = self.chunkSize
+		key = (x // size, y // size, z // size)
+		chunk = self.chunks.get(key)
+		if chunk is None:
+			if not partID:
+				return
+			chunk = np.zeros((size, size, size), dtype=np.int32)
+			self.chunks[key] = chunk
+			self.chunkCounts[key] = 0
+		i, j, k = x % size, y % size, z % size
+		wasOccupied = chunk.item(i, j, k) != 0
+		chunk[i, j, k] = partID
+		if partID and not wasOccupied:
+			self.chunkCounts[key] += 1
+		elif wasOccupied and not partID:
+			self.chunkCounts[key] -= 1
+			if self.chunkCounts[key] == 0:
+				del self.chunks[key]
+				del self.chunkCounts[key]
+				
+	def occupiedBlocks(self):
+		allI, allJ, allK = [], [], []
+		size = self.chunkSize
+		for (cx, cy, cz), chunk in self.chunks.items():
+			i, j, k = np.nonzero(chunk)
+			allI.append(i + cx * size)
+			allJ.append(j + cy * size)
+			allK.append(k + cz * size)
+		if not allI:
+			empty = np.zeros(0, dtype=np.int64)
+			return empty, empty, empty
+		i, j, k = np.concatenate(allI), np.concatenate(allJ), np.concatenate(allK)
+		order = np.lexsort((j, i, k))
+		return i[order], j[order], k[order]
+	
+	def clear(self):
+		self.chunks.clear()
+		self.chunkCounts.clear()
+		
+class OccupationBatch(object):
+	# This collects the blocks all the parts of one tree want to occupy on one day, in the order the parts
+	# asked for them, so they can all be worked out at once (see BATCH_BLOCK_OCCUPATION).
+	# Each part first announces itself (with whether it has anything new to claim), then adds its blocks 
+	# as loose locations, solid lines or arrays of blocks. Each of these is either bounded above ground, 
+	# bounded below ground, or not bounded at all (aboveGround is True, False or None),
+	# which is kept as 1, 0 or -1.
+	def __init__(self):
+		self.parts = []
+		self.partsChanged = []
+		self.locations = [] # (x, y, z) tuples
+		self.locationParts = []
+		self.locationBounding = []
+		self.lineStarts = []
+		self.lineEnds = []
+		self.lineParts = []
+		self.lineBounding = []
+		self.voxelArrays = []
+		self.voxelArrayParts = []
+		self.voxelArrayBounding = []
+		
+	def addPart(self, treePart, changed):
+		self.parts.append(treePart)
+		self.partsChanged.append(changed)
+		
+	def addLocations(self, locations, aboveGround):
+		partIndex = len(self.parts) - 1
+		bounding = self.boundingFor(aboveGround)
+		for location in locations:
+			self.locations.append((location.x, location.y, location.z))
+			self.locationParts.append(partIndex)
+			self.locationBounding.append(bounding)
+			
+	def addLine(self, firstLocation, secondLocation, aboveGround):
+		self.lineStarts.append((firstLocation.x, firstLocation.y, firstLocation.z))
+		self.lineEnds.append((secondLocation.x, secondLocation.y, secondLocation.z))
+		self.lineParts.append(len(self.parts) - 1)
+		self.lineBounding.append(self.boundingFor(aboveGround))
+		
+	def addVoxels(self, voxels, aboveGround):
+		self.voxelArrays.append(voxels)
+		self.voxelArrayParts.append(len(self.parts) - 1)
+		self.voxelArrayBounding.append(self.boundingFor(aboveGround))
+		
+	def boundingFor(self, aboveGround):
+		if aboveGround is None:
+			return -1
+		return int(aboveGround)
+		
+	def voxelize(self, world, unboundedLocations):
+		# Returns an array of (x, y, z) integer rows and a parallel array of part indexes (into self.parts),
+		# sorted by part, with each block only once for each part. Blocks are bounded to the world as asked,
+		# except for any block at one of the unbounded locations (the places the tree started from).
+		voxelArrays = [voxelsForCoordinates(self.locations)]
+		partArrays = [np.array(self.locationParts, dtype=np.int64)]
+		boundingArrays = [np.array(self.locationBounding, dtype=np.int8)]
+		if self.lineStarts:
+			voxels, lineIndexes = voxelsCrossedByLines(self.lineStarts, self.lineEnds)
+			voxelArrays.append(voxels)
+			partArrays.append(np.array(self.lineParts, dtype=np.int64)[lineIndexes])
+			boundingArrays.append(np.array(self.lineBounding, dtype=np.int8)[lineIndexes])
+		for voxels, partIndex, bounding in zip(self.voxelArrays, self.voxelArrayParts, self.voxelArrayBounding):
+			voxelArrays.append(voxels)
+			partArrays.append(np.repeat(partIndex, len(voxels)))
+			boundingArrays.append(np.repeat(np.int8(bounding), len(voxels)))
+		voxels = np.concatenate(voxelArrays).astype(np.int64)
+		partIndexes = np.concatenate(partArrays)
+		bounding = np.concatenate(boundingArrays)
+		bounded = bounding >= 0
+		for location in unboundedLocations:
+			bounded &= ~((voxels[:,0] == location.x) & (voxels[:,1] == location.y) & (voxels[:,2] == location.z))
+		voxels[bounded] = world.boundVoxels(voxels[bounded], bounding[bounded] == 1)
+		if not len(voxels):
+			return voxels, partIndexes
+		rows = np.unique(np.column_stack((partIndexes, voxels)), axis=0)
+		return rows[:,1:], rows[:,0]
+		
+class ResourceIndex(object):
+	# A summed-volume table over a water or mineral map, so the total in any box can be read
+	# from its eight corners instead of adding up every block in it.
+	# Roots deplete the map as they go, so the index remembers which chunks of the map have changed
+	# since the table was built, and adds up the changes in those chunks directly.
+	# When too much of the map has changed the table is rebuilt.
+	def __init__(self, resource, chunkSize=8, rebuildFraction=0.1):
+		self.resource = resource
+		self.chunkSize = chunkSize
+		chunksShape = tuple((size + chunkSize - 1) // chunkSize for size in resource.shape)
+		self.changedChunks = np.zeros(chunksShape, dtype=bool)
+		self.maxChangedChunks = max(1, int(rebuildFraction * self.changedChunks.size))
+		self.rebuild()
+		
+	def rebuild(self):
+		sizeX, sizeY, sizeZ = self.resource.shape
+		self.table = np.zeros((sizeX+1, sizeY+1, sizeZ+1))
+		self.table[1:, 1:, 1:] = self.resource.cumsum(0, dtype=np.float64).cumsum(1).cumsum(2)
+		self.snapshot = self.resource.copy()
+		self.changedChunks.fill(False)
+		self.numChangedChunks = 0
+		
+	def markChanged(self, starts, stops):
+		# The boxes that changed come as their start and stop corners on the map, one row per box.
+		size = self.chunkSize
+		region, covered = unionOfBoxes(np.asarray(starts) // size, (np.asarray(stops) + size - 1) // size, self.changedChunks.shape)
+		chunks = self.changedChunks[region]
+		self.numChangedChunks += int(np.count_nonzero(covered & ~chunks))
+		chunks |= covered
+		if self.numChangedChunks > self.maxChangedChunks:
+			self.rebuild()
+			
+	def total(self, region):
+		x0, x1 = region[0].start, region[0].stop
+		y0, y1 = region[1].start, region[1].stop
+		z0, z1 = region[2].start, region[2].stop
+		if x1 <= x0 or y1 <= y0 or z1 <= z0:
+			return 0.0
+		table = self.table
+		result = (table.item(x1, y1, z1) - table.item(x0, y1, z1) - table.item(x1, y0, z1) - table.item(x1, y1, z0)
+				+ table.item(x0, y0, z1) + table.item(x0, y1, z0) + table.item(x1, y0, z0) - table.item(x0, y0, z0))
+		if self.numChangedChunks:
+			size = self.chunkSize
+			cx0, cy0, cz0 = x0 // size, y0 // size, z0 // size
+			chunks = self.changedChunks[cx0:(x1 + size - 1) // size, cy0:(y1 + size - 1) // size, cz0:(z1 + size - 1) // size]
+			for i, j, k in zip(*np.nonzero(chunks)):
+				# the part of the region inside this changed chunk
+				startX, startY, startZ = (cx0 + i) * size, (cy0 + j) * size, (cz0 + k) * size
+				overlap = (slice(max(x0, startX), min(x1, startX + size)),
+						slice(max(y0, startY), min(y1, startY + size)),
+						slice(max(z0, startZ), min(z1, startZ + size)))
+				result += float(self.resource[overlap].sum(dtype=np.float64)) - float(self.snapshot[overlap].sum(dtype=np.float64))
+		return max(0.0, result)
+	
+class BestLocationMap(object):
+	# For every block of a map (2D for sun, 3D for water plus minerals), the best block within
+	# the seek radius, stored as a flat index into the map, or -1 if nothing there beats the block itself.
+	# "Best" means the same as in a plain search: the first block (in x, y, z order) with the highest value,
+	# if that is higher than the value where the seeker is.
+	# The map is built once with array operations. If the values change (as water and minerals do
+	# when roots take them up), the affected blocks are marked stale and looked up again when next asked for.
+	def __init__(self, layers, radius):
+		self.layers = layers # the maps whose values are added together
+		self.radius = radius
+		self.shape = layers[0].shape
+		self.best = self.calculateBest()
+		self.stale = np.zeros(self.shape, dtype=bool)
+		
+	def values(self, region=None):
+		if region is None:
+			region = tuple(slice(0, size) for size in self.shape)
+		total = self.layers[0][region].copy()
+		for layer in self.layers[1:]:
+			total += layer[region]
+		return total
+	
+	def calculateBest(self):
+		values = self.values()
+		bestValues = values.copy()
+		best = np.empty(self.shape, dtype=np.int32)
+		best.fill(-1)
+		flatIndices = np.arange(values.size, dtype=np.int32).reshape(self.shape)
+		# going through the offsets in x, y, z order and only taking strictly better values
+		# keeps the first of several equally good blocks, as a search would
+		for offset in itertools.product(range(-self.radius, self.radius), repeat=len(self.shape)):
+			seekers = tuple(slice(max(0, -o), min(size, size - o)) for o, size in zip(offset, self.shape))
+			candidates = tuple(slice(max(0, o), min(size, size + o)) for o, size in zip(offset, self.shape))
+			better = values[candidates] > bestValues[seekers]
+			bestValues[seekers][better] = values[candidates][better]
+			best[seekers][better] = flatIndices[candidates][better]
+		return best
+	
+	def bestIndexFor(self, position):
+		if self.stale[position]:
+			# look again, just for this block
+			region = tuple(slice(max(0, p - self.radius), max(0, min(size, p + self.radius))) for p, size in zip(position, self.shape))
+			valuesInRegion = self.values(region)
+			best = -1
+			if valuesInRegion.size:
+				bestInRegion = np.unravel_index(np.argmax(valuesInRegion), valuesInRegion.shape)
+				if valuesInRegion[bestInRegion] > self.values(tuple(slice(p, p+1) for p in position)).item():
+					best = np.ravel_multi_index(tuple(i + r.start for i, r in zip(bestInRegion, region)), self.shape)
+			self.best[position] = best
+			self.stale[position] = False
+		return self.best.item(position)
+	
+	def locationForIndex(self, index):
+		return np.unravel_index(index, self.shape)
+	
+	def markChanged(self, starts, stops):
+		# Every block whose seek region overlaps one of the changed boxes (given by their start and stop corners,
+		# one row per box) has to look again.
+		region, affected = unionOfBoxes(np.asarray(starts) - self.radius + 1, np.asarray(stops) + self.radius, self.shape)
+		self.stale[region] |= affected
+	
+def regionOfMap(resourceMap, startX, stopX, startY, stopY, startZ=None, stopZ=None):
+	# Returns slices for the part of the (half-open) region that falls on the map.
+	region = (slice(max(0, startX), max(0, min(resourceMap.shape[0], stopX))),
+			slice(max(0, startY), max(0, min(resourceMap.shape[1], stopY))))
+	if startZ is not None:
+		region += (slice(max(0, startZ), max(0, min(resourceMap.shape[2], stopZ))),)
+	return region
 
-def waterOrMineralsInRegion(waterOrMinerals, location, radius):
-	x = int(round(location.x))
-	y = int(round(location.y))
-	z = int(round(location.z))
-	startX, startY, startZ = boundXYZ(x-radius, y-radius, z-radius, aboveGround=False)
-	stopX, stopY, stopZ = boundXYZ(x+radius, y+radius, z+radius, aboveGround=False)
-	available = 0
-	locationsConsidered = []
-	if waterOrMinerals == "water":
-		resource = water
-	else:
-		resource = minerals
-	for i in range(startX, stopX):
-		for j in range(startY, stopY):
-			for k in range(startZ, stopZ):
-				if resource.has_key((i,j,k)):
-					available += resource[(i,j,k)]
-				locationsConsidered.append((i,j,k))
-	return available, locationsConsidered
-
-def seekBetterLocation(location, root, seekRadius):
-	x = int(round(location.x))
-	y = int(round(location.y))
-	z = int(round(location.z))
-	startX, startY, startZ = boundXYZ(x-seekRadius, y-seekRadius, z-seekRadius, root)
-	stopX, stopY, stopZ = boundXYZ(x+seekRadius, y+seekRadius, z+seekRadius, root)
-	bestLocation = None
-	if root:
-		if water.has_key((x,y,z)) and minerals.has_key((x,y,z)):
-			bestWaterAndMinerals = water[(x,y,z)] + minerals[(x,y,z)]
+def unionOfBoxes(starts, stops, shape):
+	# Returns the slices of the box around all the given (half-open) boxes, clipped to the shape,
+	# and an array over that box that is True wherever any of them covers it. The boxes come as their
+	# start and stop corners, one row per box. Each box adds and takes away one at its corners 
+	# in a difference array, which is then summed up along each axis, so it is one pass however many boxes overlap.
+	shape = np.array(shape)
+	starts = np.clip(starts, 0, shape)
+	stops = np.clip(stops, 0, shape)
+	inside = np.all(stops > starts, axis=1)
+	starts, stops = starts[inside], stops[inside]
+	if not len(starts):
+		return tuple(slice(0, 0) for size in shape), np.zeros((0,) * len(shape), dtype=bool)
+	low = starts.min(axis=0)
+	high = stops.max(axis=0)
+	counts = np.zeros(high - low + 1, dtype=np.int32)
+	for corner in itertools.product((0, 1), repeat=len(shape)):
+		index = tuple((stops if atStop else starts)[:, axis] - low[axis] for axis, atStop in enumerate(corner))
+		np.add.at(counts, index, (-1) ** sum(corner))
+	for axis in range(len(shape)):
+		counts = counts.cumsum(axis)
+	region = tuple(slice(start, stop) for start, stop in zip(low, high))
+	return region, counts[tuple(slice(0, stop - start) for start, stop in zip(low, high))] > 0
+
+class World(object):
+	
+	def __init__(self, sizeXY=SIZE_OF_SPACE_XY, sizeZ=SIZE_OF_SPACE_Z, groundLevel=GROUND_LEVEL, 
+				patchySun=PATCHY_SUN, patchyWater=PATCHY_WATER, numWaterPatches=NUM_WATER_PATCHES, waterPatchRadius=WATER_PATCH_RADIUS,
+				patchyMinerals=PATCHY_MINERALS, numMineralPatches=NUM_MINERAL_PATCHES, mineralPatchRadius=MINERAL_PATCH_RADIUS,
+				seed=None, infiniteXY=INFINITE_XY, spaceStorage=SPACE_STORAGE, 
+				clusterShapeCacheSize=CLUSTER_SHAPE_CACHE_SIZE, clusterShapeOrientationResolution=CLUSTER_SHAPE_ORIENTATION_RESOLUTION,
+				clusterShapePositionsPerBlock=CLUSTER_SHAPE_POSITIONS_PER_BLOCK):
+		self.sizeXY = sizeXY
+		self.sizeZ = sizeZ
+		self.groundLevel = groundLevel
+		self.patchySun = patchySun
+		self.patchyWater = patchyWater
+		self.numWaterPatches = numWaterPatches
+		self.waterPatchRadius = waterPatchRadius
+		self.patchyMinerals = patchyMinerals
+		self.numMineralPatches = numMineralPatches
+		self.mineralPatchRadius = mineralPatchRadius
+		if seed is None:
+			seed = random.randrange(2**31)
+		self.seed = seed
+		self.infiniteXY = infiniteXY
+		
+		self._sun = None
+		self._water = None
+		self._minerals = None
+		self._waterIndex = None
+		self._mineralsIndex = None
+		self.bestLocationMaps = {} # (root, seek radius): BestLocationMap
+		
+		# The space holds, for each block, the ID of the tree part at the top of its "stack".
+		# The rest of each stack (parts waiting underneath the top one) is only kept for the few blocks
+		# that are contested, in spaceStacks, keyed by (x, y, z) tuples.
+		# For shade calculations, each (x, y) column keeps a sorted list of the heights of its occupied blocks.
+		if spaceStorage == "chunked" or infiniteXY:
+			self.space = ChunkedSpace()
 		else:
-			bestWaterAndMinerals = 0
-		for i in range(startX, stopX):
-			for j in range(startY, stopY):
-				for k in range(startZ, stopZ):
-					if water.has_key((i,j,k)) and minerals.has_key((i,j,k)):
-						waterAndMinerals = water[(i,j,k)] + minerals[(i,j,k)]
-					else:
-						waterAndMinerals = 0
-					if waterAndMinerals > bestWaterAndMinerals:
-						bestWaterAndMinerals = waterAndMinerals
-						bestLocation = Point3D(i,j,k)
-	else:
-		bestSun = sun[(x, y)]
-		for i in range(startX, stopX):
-			for j in range(startY, stopY):
-				sunHere = sun[(i,j)]
-				if sunHere > bestSun:
-					bestSun = sunHere
-					bestLocation = Point3D(i,j,z)
-	if bestLocation:
-		return bestLocation
-	else:
-		return location
-	
-def colorForLocation(location):
-	if space.has_key(location):
-		if space.has_key(location) and space[location]:
-			treePart = space[location][0]
-			if treePart:
-				if COLOR_MAP == "parts":
-					name = treePart.__class__.__name__
-					if name == "Meristem":
-						if treePart.alive:
-							color = COLOR_MERISTEM[treePart.root]
-						else:
-							color = COLOR_MERISTEM_DEAD[treePart.root]
-					elif name == "Internode":
-						if treePart.alive:
-							if treePart.woody:
-								color = COLOR_INTERNODE_WOODY
-							else:
-								color = COLOR_INTERNODE_NONWOODY[treePart.root]
-						else:
-							color = COLOR_INTERNODE_DEAD[treePart.root]
-					elif name == "LeafCluster":
-						if treePart.alive:
-							color = COLOR_LEAF_CLUSTER
-						else:
-							color = COLOR_LEAF_CLUSTER_DEAD
-					elif name == "FlowerCluster":
-						if treePart.alive:
-							color = COLOR_FLOWER_CLUSTER
-						else:
-							color = COLOR_FLOWER_CLUSTER_DEAD
-					elif name == "FruitCluster":
-						if treePart.alive:
-							color = COLOR_FRUIT_CLUSTER
-						else:
-							color = COLOR_FRUIT_CLUSTER_DEAD
-					return mpcolors.colorConverter.to_rgba(color)
-				# these maxima have been determined by trial and error (mostly the latter)
-				elif COLOR_MAP == "water":
-					proportion = max(0.0, min(1.0, treePart.water / 5.0))
-					return blues(proportion)
-				elif COLOR_MAP == "minerals":
-					proportion = max(0.0, min(1.0, treePart.minerals / 5.0))
-					return copper(proportion)
-				elif COLOR_MAP == "biomass":
-					proportion = max(0.0, min(1.0, treePart.biomass / 50.0))
-					return heatmap(proportion)
-				elif COLOR_MAP == "photosynthate":
-					name = treePart.__class__.__name__
-					if name == "LeafCluster":
-						proportion = max(0.0, min(1.0, treePart.newBiomass / 20.0))
-						return greens(proportion)
+			self.space = DenseSpace(sizeXY, sizeZ)
+		self.spaceStacks = {}
+		self.spaceColumns = {}
+		self.treePartsByID = [None] # ID zero is reserved for empty blocks
+		
+		self.clusterShapes = ShapeTemplateCache(clusterShapeCacheSize, clusterShapeOrientationResolution, clusterShapePositionsPerBlock)
+		
+	def __str__(self):
+		return "World (%s x %s x %s, seed %s)" % (self.sizeXY, self.sizeXY, self.sizeZ, self.seed)
+		
+	# -------------------------------------------------------------------------------------------
+	# sun, water and minerals
+	# The sun map is a 2D array over x and y. The water and mineral maps are 3D arrays covering
+	# the ground, from the bottom of the world up to and including ground level.
+	# Anything outside the maps (as in an infinite-xy world) has no sun, water or minerals.
+	# -------------------------------------------------------------------------------------------
+	
+	@property
+	def sun(self):
+		if self._sun is None:
+			self._sun = self.generateSun()
+		return self._sun
+	
+	@property
+	def water(self):
+		if self._water is None:
+			# each map has its own random stream, so it doesn't matter which is generated first
+			self._water = self.generateWaterOrMinerals(self.patchyWater, self.numWaterPatches, self.waterPatchRadius, self.seed)
+		return self._water
+	
+	@property
+	def minerals(self):
+		if self._minerals is None:
+			self._minerals = self.generateWaterOrMinerals(self.patchyMinerals, self.numMineralPatches, self.mineralPatchRadius, self.seed + 1)
+		return self._minerals
+	
+	def generateResourceMaps(self):
+		# The maps are made the first time something needs them; this makes them all now,
+		# so a run can report it before it starts growing trees (see main).
+		return self.sun, self.water, self.minerals
+	
+	def resourceIndex(self, waterOrMinerals):
+		if waterOrMinerals == "water":
+			if self._waterIndex is None:
+				self._waterIndex = ResourceIndex(self.water)
+			return self._waterIndex
+		else:
+			if self._mineralsIndex is None:
+				self._mineralsIndex = ResourceIndex(self.minerals)
+			return self._mineralsIndex
+	
+	def generateSun(self):
+		if self.patchySun:
+			distances = np.arange(self.sizeXY) / 10.0
+			sunMap = np.abs(np.sin(distances)[:, np.newaxis] + np.cos(distances)[np.newaxis, :])
+			sunMap /= sunMap.max() # normalize sun map
+		else:
+			sunMap = np.ones((self.sizeXY, self.sizeXY))
+		return sunMap.astype(np.float32)
+	
+	def generateWaterOrMinerals(self, patchy, numPatches, patchRadius, seed):
+		depth = self.groundLevel + 1
+		if not patchy:
+			return np.ones((self.sizeXY, self.sizeXY, depth), dtype=np.float32)
+		randomState = np.random.RandomState(seed)
+		resource = np.zeros((self.sizeXY, self.sizeXY, depth), dtype=np.float32)
+		for patchNumber in range(numPatches):
+			i, j = randomState.randint(self.sizeXY, size=2)
+			k = randomState.randint(depth)
+			# patches are clipped to the edges of the map
+			patch = resource[max(0, i-patchRadius):i+patchRadius, max(0, j-patchRadius):j+patchRadius, max(0, k-patchRadius):k+patchRadius]
+			patch[:] = randomState.random_sample(patch.shape) * 2.0
+		return resource
+	
+	def sunAt(self, x, y):
+		sun = self.sun
+		if 0 <= x < sun.shape[0] and 0 <= y < sun.shape[1]:
+			return float(sun[x, y])
+		return 0.0
+	
+	def sunAtColumns(self, xs, ys):
+		# the same as sunAt, for arrays of x and y
+		sun = self.sun
+		inWorld = (xs >= 0) & (xs < sun.shape[0]) & (ys >= 0) & (ys < sun.shape[1])
+		result = np.zeros(len(xs))
+		result[inWorld] = sun[xs[inWorld], ys[inWorld]]
+		return result
+	
+	def waterOrMineralsInRegion(self, waterOrMinerals, location, radius):
+		# Returns the total available in the cube around the location, and the region of the map
+		# (as slices) that was considered, so the caller can extract from it.
+		x = int(round(location.x))
+		y = int(round(location.y))
+		z = int(round(location.z))
+		if waterOrMinerals == "water":
+			resource = self.water
+		else:
+			resource = self.minerals
+		region = regionOfMap(resource, x-radius, x+radius, y-radius, y+radius, z-radius, z+radius)
+		available = self.resourceIndex(waterOrMinerals).total(region)
+		return available, region
+	
+	def markResourceChanged(self, waterOrMinerals, starts, stops):
+		# The index is only told about the boxes of the map that changed if it has been built already;
+		# a new one is built from the map as it is. The same goes for the best locations for roots.
+		if not len(starts):
+			return
+		if waterOrMinerals == "water":
+			index = self._waterIndex
+		else:
+			index = self._mineralsIndex
+		if index is not None:
+			index.markChanged(starts, stops)
+		for (root, seekRadius), bestLocationMap in self.bestLocationMaps.items():
+			if root:
+				bestLocationMap.markChanged(starts, stops)
+	
+	def extractWaterOrMinerals(self, waterOrMinerals, locations, radius, efficiency):
+		# Root uptake for any number of root tips at once. Each tip takes the given proportion of what
+		# is left in each block of the cube around it (the same cube waterOrMineralsInRegion considers).
+		# Where cubes overlap, tips take their turns in the order given, so the result is the same as
+		# extracting for one tip after another. Returns an array of the amount each tip took.
+		if waterOrMinerals == "water":
+			resource = self.water
+		else:
+			resource = self.minerals
+		numTips = len(locations)
+		if not numTips:
+			return np.zeros(0)
+		tips = np.array([(int(round(location.x)), int(round(location.y)), int(round(location.z))) for location in locations])
+		if numTips == 1:
+			# one tip has no turns to take, so it takes straight from its region of the map
+			x, y, z = tips[0]
+			resourceInRegion = resource[regionOfMap(resource, x-radius, x+radius, y-radius, y+radius, z-radius, z+radius)]
+			extracted = efficiency * np.maximum(resourceInRegion, 0)
+			resourceInRegion -= extracted
+			amounts = np.array([float(extracted.sum())])
+		else:
+			offsets = np.arange(-radius, radius)
+			cube = np.array(np.meshgrid(offsets, offsets, offsets, indexing='ij')).reshape(3, -1).T
+			blocks = (tips[:, np.newaxis, :] + cube[np.newaxis, :, :]).reshape(-1, 3)
+			tipForBlock = np.repeat(np.arange(numTips), len(cube))
+			onMap = np.all((blocks >= 0) & (blocks < resource.shape), axis=1)
+			blockIndices = np.ravel_multi_index(blocks[onMap].T, resource.shape)
+			tipForBlock = tipForBlock[onMap]
+			# sort by block, then by tip, to find how many earlier tips reached each block first
+			order = np.lexsort((tipForBlock, blockIndices))
+			blockIndices = blockIndices[order]
+			tipForBlock = tipForBlock[order]
+			positions = np.arange(len(blockIndices))
+			firstForBlock = np.ones(len(blockIndices), dtype=bool)
+			firstForBlock[1:] = blockIndices[1:] != blockIndices[:-1]
+			turn = positions - np.maximum.accumulate(np.where(firstForBlock, positions, 0))
+			flatResource = resource.reshape(-1)
+			startingAmounts = np.maximum(flatResource[blockIndices], 0)
+			remaining = 1.0 - efficiency
+			taken = efficiency * startingAmounts * remaining ** turn
+			amounts = np.bincount(tipForBlock, weights=taken, minlength=numTips)
+			# each block loses what all the tips took from it, all at once
+			uniqueBlocks = blockIndices[firstForBlock]
+			numTurns = np.diff(np.append(positions[firstForBlock], len(blockIndices)))
+			flatResource[uniqueBlocks] -= startingAmounts[firstForBlock] * (1.0 - remaining ** numTurns)
+		# only the regions of tips that took something have changed
+		self.markResourceChanged(waterOrMinerals, tips[amounts > 0] - radius, tips[amounts > 0] + radius)
+		return amounts
+	
+	def seekBetterLocation(self, location, root, seekRadius):
+		x = int(round(location.x))
+		y = int(round(location.y))
+		z = int(round(location.z))
+		if root:
+			position = (x, y, z)
+		else:
+			position = (x, y)
+		key = (root, seekRadius)
+		if not key in self.bestLocationMaps:
+			if root:
+				self.bestLocationMaps[key] = BestLocationMap([self.water, self.minerals], seekRadius)
+			else:
+				self.bestLocationMaps[key] = BestLocationMap([self.sun], seekRadius)
+		bestLocationMap = self.bestLocationMaps[key]
+		if not all(0 <= p < size for p, size in zip(position, bestLocationMap.shape)):
+			# off the maps (in an infinite world); there may still be something better near the edge
+			return self.searchForBetterLocation(location, root, seekRadius)
+		bestIndex = bestLocationMap.bestIndexFor(position)
+		if bestIndex < 0:
+			return location
+		bestPosition = bestLocationMap.locationForIndex(bestIndex)
+		if root:
+			return Point3D(int(bestPosition[0]), int(bestPosition[1]), int(bestPosition[2]))
+		else:
+			return Point3D(int(bestPosition[0]), int(bestPosition[1]), z)
+		
+	def searchForBetterLocation(self, location, root, seekRadius):
+		x = int(round(location.x))
+		y = int(round(location.y))
+		z = int(round(location.z))
+		bestLocation = None
+		if root:
+			water = self.water
+			minerals = self.minerals
+			if 0 <= x < water.shape[0] and 0 <= y < water.shape[1] and 0 <= z < water.shape[2]:
+				bestWaterAndMinerals = water[x, y, z] + minerals[x, y, z]
+			else:
+				bestWaterAndMinerals = 0
+			region = regionOfMap(water, x-seekRadius, x+seekRadius, y-seekRadius, y+seekRadius, z-seekRadius, z+seekRadius)
+			waterAndMinerals = water[region] + minerals[region]
+			if waterAndMinerals.size:
+				# argmax finds the first best location in the same order the old nested loops did
+				i, j, k = np.unravel_index(np.argmax(waterAndMinerals), waterAndMinerals.shape)
+				if waterAndMinerals[i, j, k] > bestWaterAndMinerals:
+					bestLocation = Point3D(int(i) + region[0].start, int(j) + region[1].start, int(k) + region[2].start)
+		else:
+			sun = self.sun
+			bestSun = self.sunAt(x, y)
+			region = regionOfMap(sun, x-seekRadius, x+seekRadius, y-seekRadius, y+seekRadius)
+			sunInRegion = sun[region]
+			if sunInRegion.size:
+				i, j = np.unravel_index(np.argmax(sunInRegion), sunInRegion.shape)
+				if sunInRegion[i, j] > bestSun:
+					bestLocation = Point3D(int(i) + region[0].start, int(j) + region[1].start, z)
+		if bestLocation:
+			return bestLocation
+		else:
+			return location
+		
+	# -------------------------------------------------------------------------------------------
+	# managing blocks
+	# -------------------------------------------------------------------------------------------
+	
+	def registerTreePart(self, treePart):
+		# Every tree part gets an integer ID so it can be stored in the space.
+		self.treePartsByID.append(treePart)
+		return len(self.treePartsByID) - 1
+	
+	def treePartForID(self, partID):
+		if partID:
+			return self.treePartsByID[partID]
+		return None
+	
+	def clearSpace(self):
+		self.space.clear()
+		self.spaceStacks.clear()
+		self.spaceColumns.clear()
+		del self.treePartsByID[1:]
+	
+	def locationIsInSpace(self, x, y, z):
+		# Blocks outside the box are never drawn or shaded, so they are simply not recorded.
+		if not 0 <= z < self.sizeZ:
+			return False
+		return self.infiniteXY or (0 <= x < self.sizeXY and 0 <= y < self.sizeXY)
+	
+	def claimLocation(self, location, treePart):
+		# location should always be rounded
+		x, y, z = location.x, location.y, location.z
+		if not self.locationIsInSpace(x, y, z):
+			return
+		partID = treePart.spaceID
+		topID = self.space.ownerID(x, y, z)
+		if topID == partID:
+			return
+		if topID:
+			# push the current owner aside (to the front of the waiting stack)
+			key = (x, y, z)
+			stack = self.spaceStacks.get(key)
+			if stack is None:
+				stack = []
+				self.spaceStacks[key] = stack
+			elif partID in stack:
+				stack.remove(partID)
+			stack.insert(0, topID)
+		else:
+			column = self.spaceColumns.get((x, y))
+			if column is None:
+				column = []
+				self.spaceColumns[(x, y)] = column
+			bisect.insort(column, z)
+		self.space.setOwnerID(x, y, z, partID)
+		
+	def releaseLocation(self, location, treePart):
+		# location should always be rounded
+		x, y, z = location.x, location.y, location.z
+		if not self.locationIsInSpace(x, y, z):
+			return
+		partID = treePart.spaceID
+		key = (x, y, z)
+		stack = self.spaceStacks.get(key)
+		if self.space.ownerID(x, y, z) == partID:
+			# the next part waiting in the stack (if any) gets the block
+			if stack:
+				self.space.setOwnerID(x, y, z, stack.pop(0))
+			else:
+				self.space.setOwnerID(x, y, z, 0)
+				column = self.spaceColumns[(x, y)]
+				del column[bisect.bisect_left(column, z)]
+				if not column:
+					del self.spaceColumns[(x, y)]
+		elif stack and partID in stack:
+			stack.remove(partID)
+		if stack is not None and not stack:
+			del self.spaceStacks[key]
+		
+	def ownerOfLocation(self, location):
+		x, y, z = location.x, location.y, location.z
+		if not self.locationIsInSpace(x, y, z):
+			return None
+		return self.treePartForID(self.space.ownerID(x, y, z))
+		
+	def boundXYZ(self, x, y, z, aboveGround=True):
+		if self.infiniteXY:
+			newX, newY = x, y
+		else:
+			newX = max(0, min(self.sizeXY-1, x))
+			newY = max(0, min(self.sizeXY-1, y))
+		if aboveGround:
+			newZ = max(self.groundLevel+1, min(self.sizeZ-1, z))
+		else:
+			newZ = max(0, min(self.groundLevel + ROOTS_CAN_GROW_THIS_MANY_BLOCKS_ABOVE_GROUND, z))
+		return newX, newY, newZ
+		
+	def boundLocation(self, location, aboveGround):
+		x, y, z = self.boundXYZ(location.x, location.y, location.z, aboveGround)
+		return Point3D(x, y, z)
+	
+	def boundVoxels(self, voxels, aboveGround):
+		# the same as boundXYZ, for an array of (x, y, z) rows (blocks or locations), 
+		# with a parallel array saying which are above ground
+		result = voxels.copy()
+		if not self.infiniteXY:
+			result[:,:2] = np.clip(result[:,:2], 0, self.sizeXY-1)
+		lowestZ = np.where(aboveGround, self.groundLevel+1, 0)
+		highestZ = np.where(aboveGround, self.sizeZ-1, self.groundLevel + ROOTS_CAN_GROW_THIS_MANY_BLOCKS_ABOVE_GROUND)
+		result[:,2] = np.maximum(lowestZ, np.minimum(highestZ, result[:,2]))
+		return result
+	
+	def blocksOccupiedAboveLocation(self, location, treePart):
+		# All blocks above the location in its column (up to the top of the world)
+		# that are occupied by anything except the asking tree part.
+		x = int(round(location.x))
+		y = int(round(location.y))
+		z = int(round(location.z))
+		column = self.spaceColumns.get((x, y))
+		if not column:
+			return 0
+		result = len(column) - bisect.bisect_right(column, z)
+		if result:
+			# the asking part's own blocks don't shade it; there are only a few of these to check.
+			# Parts keep their blocks from one day to the next, so a block the part is on top of 
+			# is counted only if some other part is waiting under it (which is who would have it otherwise)
+			myBlocksAbove = set()
+			for block in treePart.blocks:
+				if block.x == x and block.y == y and block.z > z and self.space.ownerID(x, y, block.z) == treePart.spaceID \
+						and not (x, y, block.z) in self.spaceStacks:
+					myBlocksAbove.add(block.z)
+			result -= len(myBlocksAbove)
+		return result
+	
+def colorForLocation(world, location):
+	treePart = world.ownerOfLocation(location)
+	if treePart:
+		if COLOR_MAP == "parts":
+			name = treePart.typeName
+			if name == "Meristem":
+				if treePart.alive:
+					color = COLOR_MERISTEM[treePart.root]
+				else:
+					color = COLOR_MERISTEM_DEAD[treePart.root]
+			elif name == "Internode":
+				if treePart.alive:
+					if treePart.woody:
+						color = COLOR_INTERNODE_WOODY
 					else:
-						return greens(0.0)
+						color = COLOR_INTERNODE_NONWOODY[treePart.root]
+				else:
+					color = COLOR_INTERNODE_DEAD[treePart.root]
+			elif name == "LeafCluster":
+				if treePart.alive:
+					color = COLOR_LEAF_CLUSTER
+				else:
+					color = COLOR_LEAF_CLUSTER_DEAD
+			elif name == "FlowerCluster":
+				if treePart.alive:
+					color = COLOR_FLOWER_CLUSTER
+				else:
+					color = COLOR_FLOWER_CLUSTER_DEAD
+			elif name == "FruitCluster":
+				if treePart.alive:
+					color = COLOR_FRUIT_CLUSTER
+				else:
+					color = COLOR_FRUIT_CLUSTER_DEAD
+			return mpcolors.colorConverter.to_rgba(color)
+		# these maxima have been determined by trial and error (mostly the latter)
+		elif COLOR_MAP == "water":
+			proportion = max(0.0, min(1.0, treePart.water / 5.0))
+			return blues(proportion)
+		elif COLOR_MAP == "minerals":
+			proportion = max(0.0, min(1.0, treePart.minerals / 5.0))
+			return copper(proportion)
+		elif COLOR_MAP == "biomass":
+			proportion = max(0.0, min(1.0, treePart.biomass / 50.0))
+			return heatmap(proportion)
+		elif COLOR_MAP == "photosynthate":
+			name = treePart.typeName
+			if name == "LeafCluster":
+				proportion = max(0.0, min(1.0, treePart.newBiomass / 20.0))
+				return greens(proportion)
+			else:
+				return greens(0.0)
 	return None
 
 # -------------------------------------------------------------------------------------------
@@ -311,25 +872,25 @@ def colorForLocation(location):
 # drawing of the blocky world it could be discarded.
 # -------------------------------------------------------------------------------------------
 
-def drawSpace(age, outputFolder, iteration, drawTrees=True, drawSun=False, drawWater=False, drawMinerals=False, drawSurface=False):
+def drawSpace(world, age, outputFolder, iteration, drawTrees=True, drawSun=False, drawWater=False, drawMinerals=False, drawSurface=False):
 	allXValues = []
 	allYValues = []
 	allZValues = []
 	allColors = []
 	if drawSun:
-		xValues, yValues, zValues, colors = sunBlocksToGraph()
+		xValues, yValues, zValues, colors = sunBlocksToGraph(world)
 		allXValues.extend(xValues)
 		allYValues.extend(yValues)
 		allZValues.extend(zValues)
 		allColors.extend(colors)
 	if drawWater:
-		xValues, yValues, zValues, colors = waterBlocksToGraph()
+		xValues, yValues, zValues, colors = waterBlocksToGraph(world)
 		allXValues.extend(xValues)
 		allYValues.extend(yValues)
 		allZValues.extend(zValues)
 		allColors.extend(colors)
 	if drawMinerals:
-		xValues, yValues, zValues, colors = mineralBlocksToGraph()
+		xValues, yValues, zValues, colors = mineralBlocksToGraph(world)
 		allXValues.extend(xValues)
 		allYValues.extend(yValues)
 		allZValues.extend(zValues)
@@ -337,113 +898,72 @@ def drawSpace(age, outputFolder, iteration, drawTrees=True, drawSun=False, drawW
 	if drawSurface:
 		spacing = 5
 		whiteColor = mpcolors.colorConverter.to_rgba('white')
-		for i in range(SIZE_OF_SPACE_XY):
-			for j in range(SIZE_OF_SPACE_XY):
+		for i in range(world.sizeXY):
+			for j in range(world.sizeXY):
 				if (i % spacing == 0) and (j % spacing == 0):
 					allXValues.append(i)
 					allYValues.append(j)
-					allZValues.append(GROUND_LEVEL+1)
+					allZValues.append(world.groundLevel+1)
 					allColors.append(whiteColor)
 	if drawTrees:
 		xValues = []
 		yValues = []
 		zValues = []
 		colors = []
-		# the sorted method looks much better, but is far slower
-		# so I turn it off when I want speed
-		sortByDimension = True
-		if not sortByDimension:
-			for key in space:
-				color = colorForLocation(key)
-				if color:
-					xValues.append(key.x)
-					yValues.append(key.y)
-					zValues.append(key.z)
-					colors.append(color)
-		else:
-			for k in range (SIZE_OF_SPACE_Z): # order by height
-				for i in range(SIZE_OF_SPACE_XY):
-					for j in range(SIZE_OF_SPACE_XY):
-						location = Point3D(i,j,k)
-						if space.has_key(location):
-							color = colorForLocation(location)
-							if color:
-								xValues.append(i)
-								yValues.append(j)
-								zValues.append(k)
-								colors.append(color)
+		# the occupied blocks come out of the space sorted by height, which looks much better
+		occupiedI, occupiedJ, occupiedK = world.space.occupiedBlocks()
+		for i, j, k in zip(occupiedI.tolist(), occupiedJ.tolist(), occupiedK.tolist()):
+			color = colorForLocation(world, Point3D(i,j,k))
+			if color:
+				xValues.append(i)
+				yValues.append(j)
+				zValues.append(k)
+				colors.append(color)
 		allXValues.extend(xValues)
 		allYValues.extend(yValues)
 		allZValues.extend(zValues)
 		allColors.extend(colors)
 	filename = "Tree growth species %s number %s age %s" % (SPECIES, iteration, age)
-	graphPNG3DScatter(allXValues, allYValues, allZValues, allColors, SIZE_OF_SPACE_XY, "x", "y", "z", "tree growth", filename, outputFolder)
+	graphPNG3DScatter(allXValues, allYValues, allZValues, allColors, world.sizeXY, "x", "y", "z", "tree growth", filename, outputFolder)
 	
-def drawSunDistribution(outputFolder):
-	xValues, yValues, zValues, colors = sunBlocksToGraph()
-	graphPNG3DScatter(xValues, yValues, zValues, colors, SIZE_OF_SPACE_XY, "x", "y", "z", "sun coverage", "Sun coverage", outputFolder)
+def drawSunDistribution(world, outputFolder):
+	xValues, yValues, zValues, colors = sunBlocksToGraph(world)
+	graphPNG3DScatter(xValues, yValues, zValues, colors, world.sizeXY, "x", "y", "z", "sun coverage", "Sun coverage", outputFolder)
 	print 'sun coverage graphed'
 	
-def sunBlocksToGraph():
-	xValues = []
-	yValues = []
-	zValues = []
-	colors = []
-	for i in range(SIZE_OF_SPACE_XY):
-		for j in range(SIZE_OF_SPACE_XY):
-			if sun[(i,j)] > 0:
-				xValues.append(i)
-				yValues.append(j)
-				#zValues.append(SIZE_OF_SPACE_Z - 1)
-				zValues.append(0)
-				color = autumn(sun[(i,j)])
-				colors.append(color)
+def sunBlocksToGraph(world):
+	sun = world.sun
+	i, j = np.nonzero(sun > 0)
+	xValues = i.tolist()
+	yValues = j.tolist()
+	#zValues = [world.sizeZ - 1] * len(xValues)
+	zValues = [0] * len(xValues)
+	colors = list(autumn(sun[i, j]))
 	return xValues, yValues, zValues, colors
 		
-def drawWaterDistribution(outputFolder):
-	xValues, yValues, zValues, colors = waterBlocksToGraph()
+def drawWaterDistribution(world, outputFolder):
+	xValues, yValues, zValues, colors = waterBlocksToGraph(world)
 	graphPNG3DScatter(xValues, yValues, zValues, colors, 
-					SIZE_OF_SPACE_XY, "x", "y", "z", "water distribution", "Water distribution", outputFolder, drawLines=False)
+					world.sizeXY, "x", "y", "z", "water distribution", "Water distribution", outputFolder, drawLines=False)
 	print 'water distribution graphed'
 	
-def waterBlocksToGraph():
-	xValues = []
-	yValues = []
-	zValues = []
-	colors = []
-	blues = cm.get_cmap("Blues")
-	for k in range(GROUND_LEVEL):
-		for i in range(SIZE_OF_SPACE_XY):
-			for j in range(SIZE_OF_SPACE_XY):
-				if water.has_key((i,j,k)) and water[(i,j,k)] > 0:
-					xValues.append(i)
-					yValues.append(j)
-					zValues.append(k)
-					color = blues(water[(i,j,k)])
-					colors.append(color)
-	return xValues, yValues, zValues, colors
+def waterBlocksToGraph(world):
+	return waterOrMineralBlocksToGraph(world, world.water, blues)
 
-def drawMineralsDistribution(outputFolder):
-	xValues, yValues, zValues, colors = mineralBlocksToGraph()
+def drawMineralsDistribution(world, outputFolder):
+	xValues, yValues, zValues, colors = mineralBlocksToGraph(world)
 	graphPNG3DScatter(xValues, yValues, zValues, colors, 
-					SIZE_OF_SPACE_XY, "x", "y", "z", "mineral deposits", "Mineral deposits", outputFolder, drawLines=False)
+					world.sizeXY, "x", "y", "z", "mineral deposits", "Mineral deposits", outputFolder, drawLines=False)
 	print 'mineral deposits graphed'
 	
-def mineralBlocksToGraph():
-	xValues = []
-	yValues = []
-	zValues = []
-	colors = []
-	for k in range(GROUND_LEVEL):
-		for i in range(SIZE_OF_SPACE_XY):
-			for j in range(SIZE_OF_SPACE_XY):
-				if minerals.has_key((i,j,k)) and minerals[(i,j,k)] > 0:
-					xValues.append(i)
-					yValues.append(j)
-					zValues.append(k)
-					color = copper(minerals[(i,j,k)])
-					colors.append(color)
-	return xValues, yValues, zValues, colors
+def mineralBlocksToGraph(world):
+	return waterOrMineralBlocksToGraph(world, world.minerals, copper)
+
+def waterOrMineralBlocksToGraph(world, resource, colorMap):
+	# ordered by height, then x, then y
+	k, i, j = np.nonzero(resource.transpose(2, 0, 1)[:world.groundLevel] > 0)
+	colors = list(colorMap(resource[i, j, k]))
+	return i.tolist(), j.tolist(), k.tolist(), colors
 
 # -------------------------------------------------------------------------------------------
 # Graphing 3d space using scatter plot.